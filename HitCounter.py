@@ -15,53 +15,493 @@ Follow-up: What if our system has limited memory?
 
 '''
 
+import os
+import zlib
+import struct
 import time as t
+import threading
+import itertools
+from array import array
+from bisect import bisect_left, bisect_right
 
 start = t.time()
 
 class HitCounter:
-    
-    def __init__(self):
-        ''' records a hit that happened at timestamp '''
-        self.timestamp = [t.time() - start]
-        self.count = [0]
-        pass
-    
+    '''
+    keeps track of hits: exactly for the recent ones, in rollups for older ones.
+
+     - hot window: the timestamps of the last `hot_seconds`, sorted in an
+       array of doubles, so a range in it is two bisects, O(log n), and exact
+     - rollups: per second for an hour, per minute for a day and per hour
+       for a year (a RingHitCounter each, fixed memory)
+
+    every hit goes into the hot window and into each rollup. range takes
+    the part of the range the hot window holds from it, and the rest from
+    the finest rollup that still goes back to `lower`.
+    '''
+
+    # (seconds per bucket, seconds kept) of each rollup, finest first
+    TIERS = ((1, 3600), (60, 86400), (3600, 366 * 86400))
+
+    def __init__(self, hot_seconds=60, tiers=TIERS):
+        self.hot_seconds = hot_seconds
+        self.hot = array('d')
+        # hot[:hot_first] have left the window, they are removed in bulk
+        self.hot_first = 0
+        # every hit from this time on is in the hot window
+        self.hot_from = float('-inf')
+        self.tiers = [RingHitCounter(resolution, retention) for resolution, retention in tiers]
+        self.hits = 0
+
+    def record(self, timestamp=None):
+        ''' records a hit that happened at timestamp (default now) '''
+        if timestamp is None:
+            timestamp = t.time()
+        self.hits += 1
+        for tier in self.tiers:
+            tier.record(timestamp)
+        if timestamp < self.hot_from:
+            return
+
+        hot = self.hot
+        if not hot or timestamp >= hot[-1]:
+            hot.append(timestamp)
+        else:
+            hot.insert(bisect_right(hot, timestamp, self.hot_first), timestamp)
+
+        cutoff = hot[-1] - self.hot_seconds
+        if hot[self.hot_first] < cutoff:
+            self.hot_first = bisect_left(hot, cutoff, self.hot_first)
+            self.hot_from = cutoff
+            if self.hot_first > len(hot) // 2:
+                del hot[:self.hot_first]
+                self.hot_first = 0
+
+    def total(self):
+        ''' returns the total number of hits recorded '''
+        return self.hits
+
+    def range_exact(self, lower, upper):
+        '''
+        the number of hits between timestamps lower and upper (inclusive),
+        and True if that is exact.
+
+        the part of the range in the hot window is exact. before it, a
+        rollup counts whole buckets, which is exact when lower is on the
+        edge of a bucket and the range goes on into the hot window.
+        '''
+        if upper < lower:
+            return 0, True
+        hot, first = self.hot, self.hot_first
+        count, exact = 0, True
+        if upper >= self.hot_from:
+            count += bisect_right(hot, upper, first) - bisect_left(hot, max(lower, self.hot_from), first)
+        if lower >= self.hot_from:
+            return count, exact
+
+        tier = next((tier for tier in self.tiers if tier.slot(lower) > tier.newest - tier.n_buckets), None)
+        if tier is None:
+            # older than all the rollups keep, count what is left
+            tier = self.tiers[-1]
+            exact = False
+        if upper < self.hot_from:
+            # the bucket of upper may hold later hits too
+            return count + tier.range(lower, upper), False
+
+        # the bucket of hot_from is shared with the hot window, so the hits
+        # the hot window has in it are taken off
+        edge = tier.slot(self.hot_from)
+        edge_end = (edge + 1) * tier.resolution
+        count += tier.count_slots(tier.slot(lower), edge)
+        count -= bisect_left(hot, edge_end, first) - bisect_left(hot, self.hot_from, first)
+        return count, exact and lower % tier.resolution == 0
+
+    def range(self, lower, upper):
+        ''' returns the number of hits that occurred between timestamps lower and upper (inclusive) '''
+        return self.range_exact(lower, upper)[0]
+
+    def aHitOccurs(self):
+        ''' a hit occurs and gets recorded '''
+        self.record(t.time() - start)
+
+    _HEADER = struct.Struct('<ddQIQ')
+
+    def to_bytes(self):
+        ''' the state of the counter: settings, rollups, then the hot window '''
+        hot = self.hot[self.hot_first:]
+        return b''.join([self._HEADER.pack(self.hot_seconds, self.hot_from, self.hits,
+                                           len(self.tiers), len(hot))]
+                        + [tier.to_bytes() for tier in self.tiers]
+                        + [hot.tobytes()])
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        ''' a counter from to_bytes, and the offset after it '''
+        hot_seconds, hot_from, hits, n_tiers, n_hot = cls._HEADER.unpack_from(data, offset)
+        offset += cls._HEADER.size
+        counter = cls(hot_seconds, tiers=())
+        counter.hot_from, counter.hits = hot_from, hits
+        for _ in range(n_tiers):
+            tier, offset = RingHitCounter.from_bytes(data, offset)
+            counter.tiers.append(tier)
+        counter.hot.frombytes(data[offset:offset + 8 * n_hot])
+        return counter, offset + 8 * n_hot
+
+
+class RingHitCounter:
+    '''
+    a HitCounter with fixed memory (the follow-up question).
+
+    time is cut into buckets of `resolution` seconds and only the last
+    `retention` seconds are kept, in a ring of counts: a bucket holds the
+    hits of one time slot (slot = timestamp // resolution, bucket = slot %
+    number of buckets) and remembers which slot that is, so a count left
+    from an old slot is reset when the ring comes round to it.
+
+    record is O(1), range is O(buckets in the range) and the memory does
+    not grow with the hits. range counts whole buckets, so it is only
+    exact to `resolution` seconds.
+    '''
+
+    def __init__(self, resolution=1.0, retention=3600):
+        '''
+        resolution: seconds per bucket
+        retention: seconds of hits kept for range (total counts every hit)
+        '''
+        self.resolution = resolution
+        self.retention = retention
+        self.n_buckets = max(1, round(retention / resolution))
+        self.counts = array('Q', bytes(8 * self.n_buckets))
+        # slot held by each bucket, -1 for none yet
+        self.slots = array('q', [-1]) * self.n_buckets
+        self.hits = 0
+        self.newest = -1
+
+    def slot(self, timestamp):
+        ''' the time slot of a timestamp '''
+        return int(timestamp // self.resolution)
+
+    def record(self, timestamp=None, hits=1):
+        ''' records a hit that happened at timestamp (default now) '''
+        if timestamp is None:
+            timestamp = t.time()
+        self.hits += hits
+        slot = self.slot(timestamp)
+        if slot <= self.newest - self.n_buckets:
+            # older than the ring holds: only in the total
+            return
+        i = slot % self.n_buckets
+        if self.slots[i] != slot:
+            self.slots[i] = slot
+            self.counts[i] = 0
+        self.counts[i] += hits
+        if slot > self.newest:
+            self.newest = slot
+
+    def total(self):
+        ''' returns the total number of hits recorded '''
+        return self.hits
+
+    def count_slots(self, first, last):
+        ''' hits in the time slots first to last (inclusive) that are still kept '''
+        first = max(first, self.newest - self.n_buckets + 1)
+        last = min(last, self.newest)
+        n_buckets, slots, counts = self.n_buckets, self.slots, self.counts
+        hits = 0
+        for slot in range(first, last + 1):
+            i = slot % n_buckets
+            if slots[i] == slot:
+                hits += counts[i]
+        return hits
+
+    def range(self, lower, upper):
+        ''' returns the number of hits in the buckets from timestamp lower to upper (inclusive) '''
+        return self.count_slots(self.slot(lower), self.slot(upper))
+
+    def aHitOccurs(self):
+        ''' a hit occurs and gets recorded '''
+        self.record(t.time() - start)
+
+    _HEADER = struct.Struct('<ddIQq')
+
+    def to_bytes(self):
+        ''' the state of the counter: settings, then the two bucket arrays '''
+        return (self._HEADER.pack(self.resolution, self.retention, self.n_buckets, self.hits, self.newest)
+                + self.counts.tobytes() + self.slots.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        ''' a counter from to_bytes, and the offset after it '''
+        resolution, retention, n_buckets, hits, newest = cls._HEADER.unpack_from(data, offset)
+        offset += cls._HEADER.size
+        counter = cls.__new__(cls)
+        counter.resolution, counter.retention, counter.n_buckets = resolution, retention, n_buckets
+        counter.hits, counter.newest = hits, newest
+        counter.counts, counter.slots = array('Q'), array('q')
+        counter.counts.frombytes(data[offset:offset + 8 * n_buckets])
+        counter.slots.frombytes(data[offset + 8 * n_buckets:offset + 16 * n_buckets])
+        return counter, offset + 16 * n_buckets
+
+
+class ShardedHitCounter:
+    '''
+    a HitCounter that many threads can record to at once.
+
+    the hits are spread over `shards` counters, each with its own lock. a
+    thread always records to the same shard (given out in turn the first
+    time it records), so threads seldom wait for each other and there is
+    no lock shared by all of them. total and range add the shards up when
+    they are asked.
+    '''
+
+    def __init__(self, shards=16, factory=HitCounter):
+        '''
+        shards: number of counters the hits are spread over
+        factory: makes one counter, HitCounter or RingHitCounter (or a lambda with settings)
+        '''
+        self.shards = [factory() for _ in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+
+    def _shard(self):
+        ''' the shard of this thread '''
+        try:
+            return self._local.shard
+        except AttributeError:
+            # next() on itertools.count is atomic, so two threads never get the same turn
+            self._local.shard = next(self._next_shard) % len(self.shards)
+            return self._local.shard
+
+    def record(self, timestamp=None):
+        ''' records a hit that happened at timestamp (default now) '''
+        if timestamp is None:
+            timestamp = t.time()
+        i = self._shard()
+        with self.locks[i]:
+            self.shards[i].record(timestamp)
+
+    def total(self):
+        ''' returns the total number of hits recorded '''
+        hits = 0
+        for lock, shard in zip(self.locks, self.shards):
+            with lock:
+                hits += shard.total()
+        return hits
+
+    def range_exact(self, lower, upper):
+        ''' the number of hits between lower and upper (inclusive), and True if that is exact '''
+        count, exact = 0, True
+        for lock, shard in zip(self.locks, self.shards):
+            with lock:
+                if hasattr(shard, 'range_exact'):
+                    shard_count, shard_exact = shard.range_exact(lower, upper)
+                else:
+                    shard_count, shard_exact = shard.range(lower, upper), False
+            count += shard_count
+            exact = exact and shard_exact
+        return count, exact
+
+    def range(self, lower, upper):
+        ''' returns the number of hits that occurred between timestamps lower and upper (inclusive) '''
+        return self.range_exact(lower, upper)[0]
+
+    def aHitOccurs(self):
+        ''' a hit occurs and gets recorded '''
+        self.record(t.time() - start)
+
+
+class PersistentHitCounter:
+    '''
+    a HitCounter (or RingHitCounter) that is kept across restarts.
+
+    two files:
+        <path>.snapshot  the whole state of the counter (see to_bytes),
+                         written every `snapshot_seconds` to a temporary file
+                         that then replaces the old one
+        <path>.log       the timestamps recorded since that snapshot,
+                         8 bytes each, appended as they come (optional)
+
+    the log is handed to the operating system after every hit by default,
+    so a crash of the program loses nothing. `flush_seconds` lets hits
+    wait in memory for up to that long (faster, a crash loses them), and
+    `sync` also fsyncs each hit (slower, survives a power cut). without the
+    log, the hits since the last snapshot are lost on a crash, and close()
+    takes a snapshot.
+
+    the snapshot is the size of the bucket arrays and the hot window, not
+    of the number of hits, so starting again takes milliseconds: read the
+    snapshot, then record the few timestamps in the log again.
+
+    the snapshot and the log carry a generation number, so if the program
+    stops after a new snapshot but before the log is started again, the old
+    log (already in the snapshot) is not counted twice.
+    '''
+
+    _SNAPSHOT = struct.Struct('<4sBQI')
+    _LOG = struct.Struct('<4sQ')
+    _KINDS = [HitCounter, RingHitCounter]
+
+    def __init__(self, path, factory=HitCounter, snapshot_seconds=60, log=True, flush_seconds=0, sync=False):
+        '''
+        path: path of the files, without the .snapshot / .log ending
+        factory: makes the counter when there is no snapshot yet
+        snapshot_seconds: time between two snapshots (None: only when snapshot() is called)
+        log: keep the log of the hits since the last snapshot
+        flush_seconds: longest time a logged hit waits in memory (0: none)
+        sync: fsync the log after every hit
+        '''
+        self.path = path
+        self.snapshot_seconds = snapshot_seconds
+        self.flush_seconds = flush_seconds
+        self.sync = sync
+        self.counter, self.generation = self._load_snapshot()
+        if self.counter is None:
+            self.counter = factory()
+        replayed = self._replay_log()
+        self._last_snapshot = self._last_flush = t.monotonic()
+        self._log = None
+        if log:
+            self._log = open(path + '.log', 'ab')
+            if self._log.tell() == 0:
+                self._log.write(self._LOG.pack(b'HLOG', self.generation))
+                self._log.flush()
+        elif replayed:
+            # keep the hits of the log left by an earlier run in a snapshot
+            self.snapshot()
+            os.remove(path + '.log')
+
+    def _load_snapshot(self):
+        ''' the counter and generation of the snapshot file, (None, 0) if there is none '''
+        try:
+            with open(self.path + '.snapshot', 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None, 0
+        magic, kind, generation, crc = self._SNAPSHOT.unpack_from(data)
+        body = memoryview(data)[self._SNAPSHOT.size:]
+        if magic != b'HITS' or zlib.crc32(body) != crc:
+            raise ValueError(f'{self.path}.snapshot is not a valid snapshot')
+        counter, _ = self._KINDS[kind].from_bytes(body)
+        return counter, generation
+
+    def _replay_log(self):
+        ''' record the hits logged since the snapshot again, return True if there were any '''
+        try:
+            with open(self.path + '.log', 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        if len(data) < self._LOG.size:
+            os.truncate(self.path + '.log', 0)
+            return False
+        magic, generation = self._LOG.unpack_from(data)
+        if magic != b'HLOG' or generation != self.generation:
+            # the log of an older snapshot, its hits are already in this one
+            os.truncate(self.path + '.log', 0)
+            return False
+        # a torn last timestamp is left out
+        n_hits = (len(data) - self._LOG.size) // 8
+        timestamps = array('d')
+        timestamps.frombytes(data[self._LOG.size:self._LOG.size + 8 * n_hits])
+        for timestamp in timestamps:
+            self.counter.record(timestamp)
+        os.truncate(self.path + '.log', self._LOG.size + 8 * n_hits)
+        return n_hits > 0
+
+    def record(self, timestamp=None):
+        ''' records a hit that happened at timestamp (default now) '''
+        if timestamp is None:
+            timestamp = t.time()
+        self.counter.record(timestamp)
+        if self._log is not None:
+            self._log.write(struct.pack('<d', timestamp))
+            if self.sync:
+                self.flush()
+            elif not self.flush_seconds or t.monotonic() - self._last_flush >= self.flush_seconds:
+                self._log.flush()
+                self._last_flush = t.monotonic()
+        if self.snapshot_seconds is not None and t.monotonic() - self._last_snapshot >= self.snapshot_seconds:
+            self.snapshot()
+
+    def snapshot(self):
+        ''' write the state of the counter to the snapshot file and start a new log '''
+        generation = self.generation + 1
+        body = self.counter.to_bytes()
+        tmp_path = self.path + '.snapshot.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._SNAPSHOT.pack(b'HITS', self._KINDS.index(type(self.counter)),
+                                        generation, zlib.crc32(body)))
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path + '.snapshot')
+
+        # the hits in the old log are in the snapshot now
+        if self._log is not None:
+            self._log.close()
+            self._log = open(self.path + '.log', 'wb')
+            self._log.write(self._LOG.pack(b'HLOG', generation))
+            self._log.flush()
+        self.generation = generation
+        self._last_snapshot = t.monotonic()
+
+    def flush(self):
+        ''' write the logged hits to disk '''
+        if self._log is not None:
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._last_flush = t.monotonic()
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+        else:
+            self.snapshot()
+
     def total(self):
         ''' returns the total number of hits recorded '''
-        return len(self.count)
+        return self.counter.total()
 
     def range(self, lower, upper):
         ''' returns the number of hits that occurred between timestamps lower and upper (inclusive) '''
-        hitsInRange = [n for n in self.timestamp if n > lower and n < upper]
-        
-        return len(hitsInRange)
+        return self.counter.range(lower, upper)
 
     def aHitOccurs(self):
         ''' a hit occurs and gets recorded '''
-        self.timestamp.append(t.time() - start)
-        self.count.append(len(self.count))
+        self.record(t.time() - start)
+
+
+if __name__ == '__main__':
+    # initialise hitcouner
+    x = HitCounter()
+    print(list(x.hot))
 
 
-# initialise hitcouner
-x = HitCounter()
-print(x.__dict__)
+    # simulate some hits
+    x.aHitOccurs()
+    print(list(x.hot))
 
+    t.sleep(0.5)
 
-# simulate some hits
-x.aHitOccurs()
-print(x.__dict__)
+    x.aHitOccurs()
+    print(list(x.hot))
 
-t.sleep(0.5)
 
-x.aHitOccurs()
-print(x.__dict__)
+    # the total
+    print('the total: ',x.total())
 
+    print('hits in range: ', x.range(0.2, 10))
+    print('hits in range, exact: ', x.range_exact(0.2, 10))
 
-# the total
-print('the total: ',x.total())
 
-print('hits in range: ', x.range(0.2, 10))
+    # with limited memory: a ring of 0.1 second buckets over the last minute
+    y = RingHitCounter(resolution=0.1, retention=60)
+    y.aHitOccurs()
+    t.sleep(0.5)
+    y.aHitOccurs()
+    print('ring total: ', y.total())
+    print('ring hits in range: ', y.range(0.2, 10))
 
 
 
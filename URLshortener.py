@@ -16,39 +16,66 @@ This was solved by D Ross. Tested by dlefcoe.
 
 import random
 
-urls = {}  # keys are long urls - values are short urls
 chars = "abcdefghijklmnopqrstuvwxyz"
 chars += chars.upper()
 chars += "0123456789"
 
 
+class URLShortener:
+    """
+    A URL shortener with an index each way.
+
+    long_to_short answers shorten (and the same url twice), short_to_long
+    answers restore and checks a new short code is unique, so both are
+    one dict lookup however many urls are stored.
+    """
+
+    def __init__(self, length=6):
+        self.length = length
+        self.long_to_short = {}
+        self.short_to_long = {}
+
+    def gen_url(self):
+        """Generate a unique short URL code."""
+        while True:
+            short = "".join(random.choices(chars, k=self.length))
+            # 62**6 codes, so this is nearly always the first try
+            if short not in self.short_to_long:
+                return short
+
+    def shorten(self, url):
+        """Shorten a url."""
+        short = self.long_to_short.get(url)
+        if short is None:
+            # this url has not been shortened so generate a new short url and add it to both indexes
+            short = self.gen_url()
+            self.long_to_short[url] = short
+            self.short_to_long[short] = url
+        return short
+
+    def restore(self, short):
+        """Restore a shortened url, None if not found."""
+        return self.short_to_long.get(short)
+
+    def __len__(self):
+        return len(self.long_to_short)
+
+
+_shortener = URLShortener()
+urls = _shortener.long_to_short  # keys are long urls - values are short urls
+
+
 def gen_url():
     """Generate a unique 6 character short URL code."""
-    short = [random.choice(chars) for i in range(6)]
-    short = "".join(short)
-    # ensure short url is unique
-    while short in urls.values():
-        return gen_url()
-    return short
+    return _shortener.gen_url()
 
 def shorten(url):
     """Shorten a url."""
-    if url in urls:
-        # this url has already been shortened
-        return urls[url]
-    else:
-        # this url has not been shortened so generate a new short url and add it to our dict
-        short = gen_url()
-        urls[url] = short
-        return short
+    return _shortener.shorten(url)
 
 def restore(short):
     """Restore a shortened url."""
-    for longurl, shorturl in urls.items():
-        if shorturl == short:
-            return longurl
-    # not found
-    return None
+    return _shortener.restore(short)
 
 def test():
     """Shorten some urls, test duplicate input, re-expand urls."""
@@ -66,4 +93,8 @@ def test():
         shortened = shorten(testurl)
         print(testurl, shortened, restore(shortened))
 
-test()
\ No newline at end of file
+    print(restore("zzzzzz"))
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,190 @@
+'''
+
+benchmark of hashlib for the hash based scripts: brute_hash.py,
+brute_hash_by_len.py (via brute_hash_search.py) and blockchain/blockchain_001.py,
+and the dedup store of perform_backup.
+
+for each algorithm (sha256, blake2b, sha1) and input size, measures the
+hashes per second of:
+ - digest: a fresh hash of the input, raw bytes out
+ - hexdigest: the same with a hex string out
+ - copy of seeded state: copy() of a state that already has a 64 byte
+   prefix, then the input (how the miners hash a header plus a proof)
+
+then the brute force loop itself (str(x).encode() and hexdigest against
+b'%d' % x and raw digest bytes), and the small input case run in one
+process against a pool of processes.
+
+the report is printed as json, and written to --output if given.
+
+usage:
+    python benchmark_hashing.py [--seconds 0.5] [--workers N] [--output FILE]
+
+'''
+
+# %%
+
+import os
+import sys
+import ssl
+import json
+import time
+import hashlib
+import argparse
+import platform
+from concurrent.futures import ProcessPoolExecutor
+
+
+ALGORITHMS = ['sha256', 'blake2b', 'sha1']
+
+# bytes: a proof / small number, a block header, a transaction list, files for dedup
+INPUT_SIZES = [8, 88, 1024, 64 * 2**10, 2**20]
+
+OUTPUTS = ['digest', 'hexdigest', 'copy of seeded state']
+
+
+def main():
+    ''' the main module '''
+    parser = argparse.ArgumentParser(description='benchmark hashlib algorithms and input shapes')
+    parser.add_argument('--seconds', type=float, default=0.5, help='time spent on each case')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes for the pool runs (default: one per core)')
+    parser.add_argument('--algorithms', nargs='+', default=ALGORITHMS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=INPUT_SIZES)
+    parser.add_argument('--output', default=None, help='json file to write the report to')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.algorithms, args.sizes, args.seconds, args.workers)
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+def _hasher(algorithm:str, size:int, output:str):
+    ''' a function that does one hash of `size` bytes, the way `output` says '''
+    new = getattr(hashlib, algorithm)
+    data = os.urandom(size)
+    if output == 'digest':
+        return lambda: new(data).digest()
+    if output == 'hexdigest':
+        return lambda: new(data).hexdigest()
+    seeded = new(os.urandom(64))
+
+    def copy_and_update():
+        state = seeded.copy()
+        state.update(data)
+        return state.digest()
+    return copy_and_update
+
+
+def rate(function, seconds:float, calls_per_check:int=100)->float:
+    ''' calls per second of function(), over about `seconds` '''
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for _ in range(calls_per_check):
+            function()
+        calls += calls_per_check
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def hash_rate(algorithm:str, size:int, output:str, seconds:float)->dict:
+    '''
+    measure one case.
+
+    args:
+        algorithm (str): name of a hashlib constructor
+        size (int): input bytes
+        output (str): one of OUTPUTS
+        seconds (float): time spent measuring
+
+    return:
+        dict with the hashes per second and MB per second
+    '''
+    per_second = rate(_hasher(algorithm, size, output), seconds, max(1, 2**16 // size))
+    return {
+        'hashes per second': round(per_second),
+        'MB per second': round(per_second * size / 1e6, 1),
+    }
+
+
+def brute_hash_rates(seconds:float, n_chars:int=3)->dict:
+    '''
+    attempts per second of the brute force loop, as it was and as
+    brute_hash_search does it.
+    '''
+    sha256 = hashlib.sha256
+    zero_bytes = n_chars // 2
+    # targets that never match (one longer than the slice), so the whole loop is timed
+    never_text = 'x' * (n_chars + 1)
+    never_bytes = bytes(zero_bytes + 1)
+
+    def text_loop(count=1000):
+        for x in range(count):
+            if sha256(str(x).encode()).hexdigest()[:n_chars] == never_text:
+                break
+
+    def bytes_loop(count=1000):
+        for x in range(count):
+            if sha256(b'%d' % x).digest()[:zero_bytes] == never_bytes:
+                break
+
+    return {
+        'str(x).encode() and hexdigest': round(1000 * rate(text_loop, seconds, 1)),
+        "b'%d' % x and digest bytes": round(1000 * rate(bytes_loop, seconds, 1)),
+    }
+
+
+def pool_rates(algorithm:str, size:int, seconds:float, workers:int)->dict:
+    '''
+    hashes per second of the digest case in one process, and in `workers`
+    processes at the same time.
+    '''
+    single = hash_rate(algorithm, size, 'digest', seconds)['hashes per second']
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # the first map starts the processes, so they are not timed
+        list(pool.map(abs, range(workers)))
+        runs = list(pool.map(hash_rate, [algorithm] * workers, [size] * workers,
+                             ['digest'] * workers, [seconds] * workers))
+    together = sum(run['hashes per second'] for run in runs)
+    return {
+        'workers': workers,
+        'single process hashes per second': single,
+        'pool hashes per second': together,
+        'speed up': round(together / single, 2) if single else None,
+    }
+
+
+def run_benchmark(algorithms:list, sizes:list, seconds:float, workers:int=None)->dict:
+    '''
+    run every case.
+
+    return:
+        dict report, algorithm -> input size -> output -> measurements
+    '''
+    workers = workers or os.cpu_count() or 1
+    report = {
+        'python': platform.python_version(),
+        'openssl': ssl.OPENSSL_VERSION,
+        'cpus': os.cpu_count(),
+        'seconds per case': seconds,
+        'algorithms': {},
+    }
+    for algorithm in algorithms:
+        report['algorithms'][algorithm] = {}
+        for size in sizes:
+            report['algorithms'][algorithm][f'{size} bytes'] = {
+                output: hash_rate(algorithm, size, output, seconds) for output in OUTPUTS}
+            print(f'{algorithm} {size} bytes: done', file=sys.stderr)
+
+    report['brute hash attempts per second'] = brute_hash_rates(seconds)
+    report['process pool'] = {algorithm: pool_rates(algorithm, min(sizes), seconds, workers)
+                              for algorithm in algorithms}
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+
+benchmark of recording hits from many threads with HitCounter.py
+
+for 1 to 32 threads, each thread records the same number of hits to:
+ - unlocked: one HitCounter with no lock (hits can be lost)
+ - one lock: one HitCounter behind a single lock (ShardedHitCounter with 1 shard)
+ - sharded: ShardedHitCounter with one shard per thread (at least 16)
+
+the hits per second and the totals are printed as json, the locked
+counters must count every hit.
+
+usage:
+    python benchmark_hitcounter.py [--hits 200000] [--threads 1 2 4 8 16 32]
+
+'''
+
+# %%
+
+import sys
+import json
+import time
+import argparse
+import threading
+
+from HitCounter import HitCounter, ShardedHitCounter
+
+
+def main():
+    ''' the main module '''
+    parser = argparse.ArgumentParser(description='benchmark HitCounter with many threads')
+    parser.add_argument('--hits', type=int, default=200_000, help='hits recorded in each run')
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    results = {}
+    for n_threads in args.threads:
+        counters = {
+            'unlocked': HitCounter(),
+            'one lock': ShardedHitCounter(shards=1),
+            'sharded': ShardedHitCounter(shards=max(16, n_threads)),
+        }
+        results[f'{n_threads} threads'] = {
+            name: record_rate(counter, n_threads, args.hits) for name, counter in counters.items()}
+        for name in ('one lock', 'sharded'):
+            assert results[f'{n_threads} threads'][name]['lost hits'] == 0, name
+        print(f'{n_threads} threads: done', file=sys.stderr)
+
+    print(json.dumps(results, indent=4))
+
+
+def record_rate(counter, n_threads:int, hits:int)->dict:
+    '''
+    record `hits` hits from `n_threads` threads at the same time.
+
+    return:
+        dict with the hits per second, the total counted and the hits lost
+    '''
+    per_thread = hits // n_threads
+    ready = threading.Barrier(n_threads + 1)
+
+    def record_hits():
+        record = counter.record
+        ready.wait()
+        for _ in range(per_thread):
+            record()
+
+    threads = [threading.Thread(target=record_hits) for _ in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    recorded = per_thread * n_threads
+    now = time.time()
+    return {
+        'hits per second': round(recorded / seconds),
+        'total': counter.total(),
+        'in range': counter.range(now - 3600, now),
+        'lost hits': recorded - counter.total(),
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+'''
+
+benchmark of URLShortener in URLshortener.py as the table grows.
+
+urls are added until the table holds --urls of them. each time the size
+doubles, the inserts per second since the last size, and the shorten
+(of a stored url), restore (of a stored code) and restore of a missing
+code per second at this size are measured. the results and the memory
+used are printed as json.
+
+usage:
+    python benchmark_urlshortener.py [--urls 10000000] [--lookups 100000]
+
+'''
+
+# %%
+
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+from URLshortener import URLShortener
+
+
+def main():
+    ''' the main module '''
+    parser = argparse.ArgumentParser(description='benchmark URLShortener as the table grows')
+    parser.add_argument('--urls', type=int, default=10_000_000, help='urls stored at the end')
+    parser.add_argument('--lookups', type=int, default=100_000, help='lookups timed at each size')
+    parser.add_argument('--memory', action='store_true',
+                        help='trace the memory used (slows the inserts down)')
+    args = parser.parse_args()
+
+    print(json.dumps(run_benchmark(args.urls, args.lookups, args.memory), indent=4))
+
+
+def lookup_rates(shortener, lookups:int)->dict:
+    ''' lookups per second on a table, for urls and codes picked at random '''
+    long_urls = random.sample(list(shortener.long_to_short), min(lookups, len(shortener)))
+    short_codes = [shortener.long_to_short[url] for url in long_urls]
+    # 7 characters, so never a stored code
+    missing = [code + 'x' for code in short_codes]
+
+    rates = {}
+    for name, function, keys in (('shorten stored per second', shortener.shorten, long_urls),
+                                  ('restore per second', shortener.restore, short_codes),
+                                  ('restore missing per second', shortener.restore, missing)):
+        start = time.perf_counter()
+        for key in keys:
+            function(key)
+        rates[name] = round(len(keys) / (time.perf_counter() - start))
+    return rates
+
+
+def run_benchmark(n_urls:int, lookups:int, memory:bool=False)->dict:
+    '''
+    grow a table to n_urls urls, measuring at each doubling.
+
+    return:
+        dict of table size -> measurements
+    '''
+    if memory:
+        tracemalloc.start()
+    shortener = URLShortener()
+    results = {}
+    size = 0
+    target = 1000
+    while size < n_urls:
+        target = min(target * 2, n_urls)
+        start = time.perf_counter()
+        for i in range(size, target):
+            shortener.shorten(f'http://www.example.com/page/{i}')
+        seconds = time.perf_counter() - start
+        inserts = target - size
+        size = target
+
+        results[f'{size} urls'] = dict(
+            {'inserts per second': round(inserts / seconds)},
+            **lookup_rates(shortener, lookups))
+        if memory:
+            results[f'{size} urls']['MB used'] = round(tracemalloc.get_traced_memory()[0] / 2**20, 1)
+        print(f'{size} urls: done', file=sys.stderr)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+'''
+
+benchmark of the Blockchain class in blockchain_001.py
+
+builds a chain of empty blocks, then times:
+ - rehash: checking every link by hashing the previous block again
+   (how the chain had to be checked before blocks stored their hash)
+ - verify: a full verify_chain()
+ - validate: the same check shared out between processes (validate)
+ - incremental verify: verify_chain() after a few more blocks are added,
+   which only checks the new blocks
+ - mining: hashes per second of a naive proof of work loop (hash the
+   whole block, compare hexdigests) and of Blockchain.mine
+ - serialisation: blocks per second hashed as sorted json (the old way),
+   as the binary encode_block, and through the binary header only
+
+usage:
+    python benchmark_blockchain.py [--blocks 1000000] [--new-blocks 1000]
+                                   [--difficulty 5] [--workers N]
+                                   [--transactions 5000]
+
+'''
+
+import os
+import json
+import time
+import hashlib
+import argparse
+
+from blockchain_001 import Blockchain, encode_block
+
+
+def timed(function, *args):
+    ''' run a function and return (result, seconds) '''
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def build_chain(n_blocks):
+    ''' a chain with n_blocks blocks (including the first one) '''
+    blockchain = Blockchain()
+    for proof in range(1, n_blocks):
+        blockchain.new_block(proof)
+    return blockchain
+
+
+def rehash_links(blockchain):
+    ''' check each previous_hash by hashing the previous block again '''
+    chain = blockchain.chain
+    for i in range(1, len(chain)):
+        if chain[i]['previous_hash'] != blockchain.hash(chain[i - 1]):
+            return False
+    return True
+
+
+def naive_hash_rate(blockchain, attempts=200_000):
+    ''' hashes per second when every attempt hashes the whole block as json '''
+    block = dict(blockchain.last_block)
+    start = time.perf_counter()
+    for proof in range(attempts):
+        block['proof'] = proof
+        hex_hash = hashlib.sha256(json.dumps(block, sort_keys=True).encode()).hexdigest()
+        if hex_hash[:5] == '00000':
+            break
+    return attempts / (time.perf_counter() - start)
+
+
+def rate(function, block, seconds=1.0):
+    ''' calls per second of function(block), over about `seconds` '''
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        function(block)
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def serialisation_rates(n_transactions):
+    ''' blocks per second hashed with json and with the binary layout '''
+    blockchain = Blockchain()
+    for i in range(n_transactions):
+        blockchain.new_transaction(f'sender{i % 97}', f'recipient{i % 89}', i)
+    block = blockchain.new_block(1)
+
+    def json_hash(block):
+        return hashlib.sha256(json.dumps(block, sort_keys=True).encode()).hexdigest()
+
+    def binary_hash(block):
+        return hashlib.sha256(encode_block(block)).hexdigest()
+
+    return {
+        'transactions per block': n_transactions,
+        'json bytes': len(json.dumps(block)),
+        'binary bytes': len(encode_block(block)),
+        'json blocks hashed per second': round(rate(json_hash, block), 1),
+        'binary blocks hashed per second': round(rate(binary_hash, block), 1),
+        'header (merkle root) hashes per second': round(rate(blockchain.hash, block), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the blockchain')
+    parser.add_argument('--blocks', type=int, default=1_000_000)
+    parser.add_argument('--new-blocks', type=int, default=1000)
+    parser.add_argument('--difficulty', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='mining and validation processes (default: one per core)')
+    parser.add_argument('--transactions', type=int, default=5000,
+                        help='transactions per block for the serialisation benchmark')
+    args = parser.parse_args()
+
+    results = {'blocks': args.blocks}
+
+    blockchain, seconds = timed(build_chain, args.blocks)
+    results['build seconds'] = round(seconds, 3)
+
+    valid, seconds = timed(rehash_links, blockchain)
+    results['rehash seconds'] = round(seconds, 3)
+
+    valid, seconds = timed(blockchain.verify_chain)
+    assert valid
+    results['verify seconds'] = round(seconds, 3)
+
+    first_invalid, seconds = timed(blockchain.validate, args.workers)
+    assert first_invalid is None
+    results[f'validate seconds ({args.workers or os.cpu_count()} processes)'] = round(seconds, 3)
+
+    for proof in range(args.new_blocks):
+        blockchain.new_block(proof)
+    valid, seconds = timed(blockchain.verify_chain)
+    assert valid
+    results[f'incremental verify seconds ({args.new_blocks} new blocks)'] = round(seconds, 6)
+
+    results['naive mining hashes per second'] = round(naive_hash_rate(blockchain))
+    blockchain.mine(args.difficulty, workers=1)
+    results['mining, 1 process'] = blockchain.mining_report
+    blockchain.mine(args.difficulty, workers=args.workers)
+    results['mining, all processes'] = blockchain.mining_report
+
+    results['serialisation'] = serialisation_rates(args.transactions)
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
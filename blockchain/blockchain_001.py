@@ -18,38 +18,503 @@ https://medium.com/coinmonks/python-tutorial-build-a-blockchain-713c706f6531
 
 import hashlib
 import json
-from time import time
+import os
+import re
+import struct
+import zlib
+import mmap
+import multiprocessing
+from multiprocessing.connection import wait
+from array import array
+from collections import OrderedDict
+from time import time, perf_counter
+
+
+# binary layout of blocks, used for hashing and storage (json is only for export).
+# all numbers are little endian, text is utf-8 with a length in front.
+#
+# header:      index (Q), timestamp (d), merkle root (32 bytes),
+#              previous hash (kind byte, then 32 bytes or length-prefixed text),
+#              proof (q, last so that miners can hash the rest once)
+# transaction: sender, recipient, amount (kind byte, then q or length-prefixed text)
+# block:       header, hash (32 bytes), number of transactions (I), transactions
+_HEADER = struct.Struct('<Qd32s')
+_PROOF = struct.Struct('<q')
+_LENGTH = struct.Struct('<I')
+_INT = struct.Struct('<q')
+_RAW, _TEXT = 0, 1
+
+
+def _encode_text(text):
+    data = text.encode()
+    return _LENGTH.pack(len(data)) + data
+
+
+def _decode_text(data, offset):
+    (length,) = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    return data[offset:offset + length].decode(), offset + length
+
+
+def _encode_hash(hex_hash):
+    ''' a sha-256 hex string is stored as 32 bytes, anything else as text '''
+    if len(hex_hash) == 64:
+        try:
+            return bytes([_RAW]) + bytes.fromhex(hex_hash)
+        except ValueError:
+            pass
+    return bytes([_TEXT]) + _encode_text(hex_hash)
+
+
+def _decode_hash(data, offset):
+    kind = data[offset]
+    if kind == _RAW:
+        return data[offset + 1:offset + 33].hex(), offset + 33
+    return _decode_text(data, offset + 1)
+
+
+def encode_transaction(transaction):
+    ''' the binary form of a transaction '''
+    amount = transaction['amount']
+    if isinstance(amount, int):
+        amount_bytes = bytes([_RAW]) + _INT.pack(amount)
+    else:
+        amount_bytes = bytes([_TEXT]) + _encode_text(amount)
+    return (_encode_text(transaction['sender'])
+            + _encode_text(transaction['recipient'])
+            + amount_bytes)
+
+
+def decode_transaction(data, offset=0):
+    '''
+    read a transaction written by encode_transaction.
+
+    return:
+        (transaction, offset just after it)
+    '''
+    sender, offset = _decode_text(data, offset)
+    recipient, offset = _decode_text(data, offset)
+    if data[offset] == _RAW:
+        (amount,) = _INT.unpack_from(data, offset + 1)
+        offset += 1 + _INT.size
+    else:
+        amount, offset = _decode_text(data, offset + 1)
+    return {'sender': sender, 'recipient': recipient, 'amount': amount}, offset
+
+
+def encode_header(block, with_proof=True):
+    ''' the binary form of a block header, the proof is left off for mining '''
+    header = (_HEADER.pack(block['index'], block['timestamp'], bytes.fromhex(block['merkle_root']))
+              + _encode_hash(block['previous_hash']))
+    if with_proof:
+        header += _PROOF.pack(block['proof'])
+    return header
+
+
+def encode_block(block):
+    ''' the binary form of a whole block, as stored '''
+    parts = [encode_header(block), bytes.fromhex(block['hash']),
+             _LENGTH.pack(len(block['transactions']))]
+    parts.extend(encode_transaction(transaction) for transaction in block['transactions'])
+    return b''.join(parts)
+
+
+def decode_block(data, offset=0):
+    '''
+    read a block written by encode_block.
+
+    return:
+        (block, offset just after it)
+    '''
+    index, timestamp, merkle_root = _HEADER.unpack_from(data, offset)
+    previous_hash, offset = _decode_hash(data, offset + _HEADER.size)
+    (proof,) = _PROOF.unpack_from(data, offset)
+    offset += _PROOF.size
+    block_hash = data[offset:offset + 32].hex()
+    (count,) = _LENGTH.unpack_from(data, offset + 32)
+    offset += 32 + _LENGTH.size
+    transactions = []
+    for _ in range(count):
+        transaction, offset = decode_transaction(data, offset)
+        transactions.append(transaction)
+    block = {
+        'index': index,
+        'timestamp': timestamp,
+        'transactions': transactions,
+        'merkle_root': merkle_root.hex(),
+        'proof': proof,
+        'previous_hash': previous_hash,
+        'hash': block_hash,
+    }
+    return block, offset
+
+
+class MerkleTree(object):
+    '''
+    a merkle tree of transactions.
+
+    each transaction is hashed (a leaf), pairs of hashes are hashed
+    together level by level up to a single root hash. an odd hash at the
+    end of a level moves up a level as it is: pairing it with itself would
+    give [t1, t2, t3] and [t1, t2, t3, t3] the same root. leaves and pairs
+    are hashed with a different first byte, so a pair can never pass for a
+    transaction.
+
+    all the levels are kept, so adding a transaction only hashes the
+    path to the root, and a proof for one transaction is O(log n) hashes.
+    '''
+
+    def __init__(self, transactions=()):
+        self.levels = [[]]
+        for transaction in transactions:
+            self.append(transaction)
+
+    @staticmethod
+    def leaf_hash(transaction):
+        ''' hash of one transaction '''
+        return hashlib.sha256(b'\x00' + encode_transaction(transaction)).digest()
+
+    @staticmethod
+    def pair_hash(left, right):
+        ''' hash of two hashes '''
+        return hashlib.sha256(b'\x01' + left + right).digest()
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def append(self, transaction):
+        ''' add a transaction and update the hashes on its path to the root '''
+        self.levels[0].append(self.leaf_hash(transaction))
+        position = len(self.levels[0]) - 1
+        level = 0
+        while len(self.levels[level]) > 1:
+            nodes = self.levels[level]
+            parent = position // 2
+            left = nodes[2 * parent]
+            # an unpaired node moves up as it is
+            node = self.pair_hash(left, nodes[2 * parent + 1]) if 2 * parent + 1 < len(nodes) else left
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            parents = self.levels[level + 1]
+            if parent < len(parents):
+                parents[parent] = node
+            else:
+                parents.append(node)
+            position = parent
+            level += 1
 
-class Blockchain(object):
-    ''' a Blockchain class '''
+    @property
+    def root(self):
+        ''' the root hash (hex), the hash of nothing for an empty tree '''
+        if not self.levels[0]:
+            return hashlib.sha256(b'').hexdigest()
+        return self.levels[-1][0].hex()
+
+    def proof(self, position):
+        '''
+        the hashes needed to go from one transaction up to the root.
+
+        inputs:
+            position: {int} position of the transaction in the tree
+        return:
+            list of [sibling hash (hex), 'left' or 'right' (side of the sibling)]
+        '''
+        if not 0 <= position < len(self):
+            raise IndexError('transaction index out of range')
+        path = []
+        for nodes in self.levels[:-1]:
+            sibling = position ^ 1
+            if sibling < len(nodes):
+                path.append([nodes[sibling].hex(), 'left' if sibling < position else 'right'])
+            # else: no sibling, the node moved up as it is
+            position //= 2
+        return path
+
+    @classmethod
+    def verify(cls, transaction, proof, root):
+        ''' True if the proof links the transaction to the root hash (hex) '''
+        node = cls.leaf_hash(transaction)
+        for sibling, side in proof:
+            sibling = bytes.fromhex(sibling)
+            node = cls.pair_hash(sibling, node) if side == 'left' else cls.pair_hash(node, sibling)
+        return node.hex() == root
+
+
+class ChainStore(object):
+    '''
+    append-only store of blocks on disk, used in place of the chain list.
+
+    two files are kept:
+        <path>.blocks   the blocks (see encode_block) one after the other, each
+                        as a record: length (I), crc32 (I), encoded block
+        <path>.index    the offset (Q) of each record in the .blocks file
+
+    opening only memory-maps the files, so store[i] (and store[-1]) reads
+    one block without loading the chain. if the program stopped in the
+    middle of a write, the torn last record is cut off when the store is
+    opened again (but not when it is opened read only).
+    '''
+
+    _RECORD = struct.Struct('<II')
+    _OFFSET = struct.Struct('<Q')
+
+    def __init__(self, path, sync=False, read_only=False):
+        '''
+        inputs:
+            path: {str} path of the store, without the .blocks / .index ending
+            sync: {bool} fsync after every block (slower, survives power cuts)
+            read_only: {bool} only read the blocks, the files are never changed
+        '''
+        self.path = path
+        self.sync = sync
+        self.read_only = read_only
+        mode = 'rb' if read_only else 'a+b'
+        self._data = open(path + '.blocks', mode)
+        self._index = open(path + '.index', mode)
+        if not read_only:
+            self._recover()
+
+        # map what is on disk now, blocks added later are read with pread
+        self._data_map = self._map(self._data)
+        self._index_map = self._map(self._index)
+        self._mapped = len(self._index_map) // self._OFFSET.size if self._index_map else 0
+        # offsets of the blocks added since the files were mapped
+        self._new_offsets = array('Q')
+        self._last = None
+
+    @staticmethod
+    def _map(f):
+        size = os.fstat(f.fileno()).st_size
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else None
+
+    def _read_record(self, offset, size):
+        ''' the encoded block at offset, or None if the record is torn '''
+        if offset + self._RECORD.size > size:
+            return None
+        length, crc = self._RECORD.unpack(os.pread(self._data.fileno(), self._RECORD.size, offset))
+        if offset + self._RECORD.size + length > size:
+            return None
+        payload = os.pread(self._data.fileno(), length, offset + self._RECORD.size)
+        if zlib.crc32(payload) != crc:
+            return None
+        return payload
+
+    def _recover(self):
+        ''' make the two files agree, cutting off a torn last record '''
+        data_size = os.fstat(self._data.fileno()).st_size
+        index_size = os.fstat(self._index.fileno()).st_size
+        count = index_size // self._OFFSET.size
+        index_fd = self._index.fileno()
+
+        # the last indexed records may point at data that was never written
+        end = 0
+        while count:
+            (offset,) = self._OFFSET.unpack(os.pread(index_fd, self._OFFSET.size, (count - 1) * self._OFFSET.size))
+            payload = self._read_record(offset, data_size)
+            if payload is not None:
+                end = offset + self._RECORD.size + len(payload)
+                break
+            count -= 1
+
+        # records written after the last indexed one are indexed, up to a torn one
+        new_offsets = array('Q')
+        while (payload := self._read_record(end, data_size)) is not None:
+            new_offsets.append(end)
+            end += self._RECORD.size + len(payload)
+
+        if index_size != count * self._OFFSET.size or new_offsets:
+            self._index.truncate(count * self._OFFSET.size)
+            # packed one by one, the array is in the byte order of this machine
+            self._index.write(b''.join(map(self._OFFSET.pack, new_offsets)))
+            self._index.flush()
+        if data_size != end:
+            self._data.truncate(end)
+
+    def __len__(self):
+        return self._mapped + len(self._new_offsets)
+
+    def _offset(self, i):
+        if i < self._mapped:
+            return self._OFFSET.unpack_from(self._index_map, i * self._OFFSET.size)[0]
+        return self._new_offsets[i - self._mapped]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('block index out of range')
+        if i == n - 1 and self._last is not None:
+            return self._last
+        offset = self._offset(i)
+        if self._data_map is not None and offset + self._RECORD.size <= len(self._data_map):
+            length, crc = self._RECORD.unpack_from(self._data_map, offset)
+            start = offset + self._RECORD.size
+            payload = self._data_map[start:start + length]
+        else:
+            payload = self._read_record(offset, os.fstat(self._data.fileno()).st_size)
+        return decode_block(payload)[0]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, block):
+        ''' write a block at the end of the store '''
+        if self.read_only:
+            raise ValueError(f'{self.path} is open read only')
+        payload = encode_block(block)
+        offset = self._data.seek(0, os.SEEK_END)
+        self._data.write(self._RECORD.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._data.flush()
+        if self.sync:
+            os.fsync(self._data.fileno())
+        # the index is written after the block, so it never points at missing data
+        self._index.write(self._OFFSET.pack(offset))
+        self._index.flush()
+        if self.sync:
+            os.fsync(self._index.fileno())
+        self._new_offsets.append(offset)
+        self._last = block
+
+    def close(self):
+        for m in (self._data_map, self._index_map):
+            if m is not None:
+                m.close()
+        self._data.close()
+        self._index.close()
+
+    def __reduce__(self):
+        # a worker process opens the same files again, read only so that it
+        # never cuts off what it takes for a torn record
+        return ChainStore, (self.path, self.sync, True)
+
+
+# a whole number, then optionally a space and a unit: '5' or '5 possy coin'
+_AMOUNT = re.compile(r'\s*(\d+)(\s+\D.*)?\s*')
+
+
+def parse_amount(amount):
+    '''
+    the amount of a transaction as a whole number of coins.
+
+    inputs:
+        amount: {int or str} 5, '5' or '5 possy coin'
+    return:
+        amount: {int}
+    raises:
+        ValueError if the amount is not a whole number of coins ('1.5', '12abc', 1.5, True, -3)
+    '''
+    if isinstance(amount, bool) or not isinstance(amount, (int, str)):
+        raise ValueError(f'not an amount of coins: {amount!r}')
+    if isinstance(amount, str):
+        match = _AMOUNT.fullmatch(amount)
+        if match is None:
+            raise ValueError(f'not an amount of coins: {amount!r}')
+        amount = int(match.group(1))
+    # stored as a signed 64 bit int (see encode_transaction)
+    if not 0 <= amount < 2**63:
+        raise ValueError(f'amount out of range: {amount!r}')
+    return amount
+
+
+class Ledger(object):
+    '''
+    index of the transactions, kept up to date as blocks are added.
+
+        balances        account -> coins received minus coins sent (confirmed blocks)
+        sent, received  account -> list of (block index, position) of its transactions
+        pending         sender -> positions in the pending transactions (the mempool)
+
+    so a balance is one lookup, and the history of an account is O(its
+    transactions) instead of a scan of the whole chain.
+    '''
 
     def __init__(self):
-        self.chain = []
-        self.pending_transactions = []
+        self.balances = {}
+        self.sent = {}
+        self.received = {}
+        self.pending = {}
+
+    def add_block(self, block):
+        ''' index the transactions of a new block, which empties the mempool '''
+        for position, transaction in enumerate(block['transactions']):
+            amount = parse_amount(transaction['amount'])
+            sender, recipient = transaction['sender'], transaction['recipient']
+            self.balances[sender] = self.balances.get(sender, 0) - amount
+            self.balances[recipient] = self.balances.get(recipient, 0) + amount
+            self.sent.setdefault(sender, []).append((block['index'], position))
+            self.received.setdefault(recipient, []).append((block['index'], position))
+        self.pending = {}
+
+    def add_pending(self, transaction, position):
+        ''' index a transaction waiting in the mempool '''
+        self.pending.setdefault(transaction['sender'], []).append(position)
+
+
+class Blockchain(object):
+    ''' a Blockchain class '''
 
-        self.new_block(previous_hash='some random hash comment from me', proof=100)
+    # merkle trees kept for get_proof
+    TREE_CACHE = 16
 
-    def new_block(self, proof, previous_hash=None):
+    def __init__(self, store=None):
+        '''
+        inputs:
+            store: a ChainStore to keep the chain on disk (optional, default a list in memory)
+        '''
+        self.chain = [] if store is None else store
+        self.pending_transactions = []
+        # merkle tree of the pending transactions, built as they arrive
+        self.pending_tree = MerkleTree()
+        # block index -> merkle tree of its transactions, for the last few
+        # blocks used (get_proof builds the others again)
+        self.trees = OrderedDict()
+        # number of blocks already checked by verify_chain
+        self.verified_upto = 0
+        # speed of the last call to mine()
+        self.mining_report = None
+        # balances and transactions per account, built when first needed
+        # (opening a big ChainStore should not read every block)
+        self._ledger = None
+
+        if not len(self.chain):
+            self.new_block(previous_hash='some random hash comment from me', proof=100)
+
+    def new_block(self, proof, previous_hash=None, timestamp=None):
         '''
         create a new block
         
         inputs:
-            proof: {str} this is a string
+            proof: {int} the proof of work, a 64 bit signed integer (it is hashed as 8 bytes)
             previous_hash: the hash
+            timestamp: time of the block (optional, default now)
         return:
             block: return the block
         '''
+        if not isinstance(proof, int) or isinstance(proof, bool):
+            raise TypeError(f'proof must be an int, not {type(proof).__name__}')
+        if not -2**63 <= proof < 2**63:
+            raise ValueError(f'proof does not fit in 64 bits: {proof}')
 
         block = {
             'index':len(self.chain) + 1, #the length of our blockchain and add 1 to it.
-            'timestamp': time(), # stamp the block when it’s created
+            'timestamp': time() if timestamp is None else timestamp, # stamp the block when it’s created
             'transactions': self.pending_transactions, # any transactions that are sitting in the ‘pending’ 
+            'merkle_root': self.pending_tree.root, # the block commits to its transactions through this
             'proof': proof, # a valid “nonce”, or “proof”
-            'previous_hash': previous_hash or self.hash(self.chain[-1]) # a hashed version of the most recent approved block
+            'previous_hash': previous_hash or self.chain[-1]['hash'] # a hashed version of the most recent approved block
         }
+        block['hash'] = self.hash(block) # worked out once, when the block is created
 
+        self._cache_tree(block['index'], self.pending_tree)
         self.pending_transactions = [] # when users send our coins to each other
+        self.pending_tree = MerkleTree()
         self.chain.append(block) # an empty list that we’ll add blocks to. Quite literally our ‘block-chain’.
+        if self._ledger is not None:
+            self._ledger.add_block(block)
 
         return block
 
@@ -65,20 +530,23 @@ class Blockchain(object):
         """method with our three most important variables
 
         Args:
-            sender ([type]): [description]
-            recipient ([type]): [description]
-            amount ([type]): [description]
+            sender (str): account sending the coins
+            recipient (str): account receiving the coins
+            amount (int or str): number of coins, '5 possy coin' is read as 5
 
         Returns:
-            [type]: the last block
+            int: index of the block the transaction will be in
         """
         transaction = {
             'sender': sender,
             'recipient': recipient,
-            'amount': amount
+            'amount': parse_amount(amount)
         }
 
+        if self._ledger is not None:
+            self._ledger.add_pending(transaction, len(self.pending_transactions))
         self.pending_transactions.append(transaction)
+        self.pending_tree.append(transaction)
 
 
         return self.last_block['index'] + 1
@@ -90,19 +558,373 @@ class Blockchain(object):
         blockchains use SHA-256, an encryption hash function,
         which takes in some text string (stored as a Unicode value)
         and spits out a 64-character long encrypted string.
-        '''
 
-        # takes our new block and changes its key/value pairs all into strings
-        string_object = json.dumps(block, sort_keys=True)
-        block_string = string_object.encode() # string into Unicode
+        the block header is hashed in its fixed binary layout (see
+        encode_header), so there is no json, key sorting or float
+        formatting on the way. the transactions are only included through
+        the merkle root, and the proof goes last, so miners can hash the
+        rest of the block once.
+        '''
 
         # create 64-character long encrypted string
-        raw_hash = hashlib.sha256(block_string)
+        raw_hash = hashlib.sha256(encode_header(block))
         hex_hash = raw_hash.hexdigest()
 
         return hex_hash
 
 
+    @staticmethod
+    def hash_prefix(block):
+        ''' the bytes hashed before the proof: the block header without the proof '''
+        return encode_header(block, with_proof=False)
+
+
+    @staticmethod
+    def valid_proof(block, difficulty):
+        ''' True if the block's hash starts with `difficulty` zeros (hex digits) '''
+        return block['hash'].startswith('0' * difficulty)
+
+
+    def mine(self, difficulty, workers=None):
+        '''
+        proof of work: find a proof that makes the hash of the next block
+        start with `difficulty` zeros (hex digits), then add the block.
+
+        the proofs are shared out between processes (proof = start + k * workers)
+        and all of them stop as soon as one finds a proof. the block without
+        its proof is hashed once, and each attempt only hashes the proof
+        on top of a copy of that state. if a worker dies without reporting,
+        the others are stopped and RuntimeError is raised.
+
+        the speed of each worker is kept in self.mining_report.
+
+        inputs:
+            difficulty: {int} number of leading zero hex digits
+            workers: {int} number of processes (optional, default: one per core)
+        return:
+            block: the new block
+        '''
+        workers = workers or os.cpu_count() or 1
+        candidate = {
+            'index': len(self.chain) + 1,
+            'timestamp': time(),
+            'transactions': self.pending_transactions,
+            'merkle_root': self.pending_tree.root,
+            'previous_hash': self.chain[-1]['hash'],
+        }
+        prefix = self.hash_prefix(candidate)
+
+        start = perf_counter()
+        if workers == 1:
+            # no need for another process
+            import threading
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            _search_proofs(prefix, difficulty, 0, 1, threading.Event(), sender)
+            reports = [receiver.recv()]
+        else:
+            context = multiprocessing.get_context()
+            found = context.Event()
+            pipes = [context.Pipe(duplex=False) for _ in range(workers)]
+            processes = [context.Process(target=_search_proofs,
+                                         args=(prefix, difficulty, i, workers, found, sender))
+                         for i, (receiver, sender) in enumerate(pipes)]
+            for process in processes:
+                process.start()
+            # the workers hold the sending ends
+            for receiver, sender in pipes:
+                sender.close()
+            reports = _collect_reports(processes, [receiver for receiver, sender in pipes], found)
+
+        # one report per worker, with the proof if it found one
+        proof = None
+        per_core = []
+        for worker_proof, attempts, seconds in reports:
+            if proof is None and worker_proof is not None:
+                proof = worker_proof
+            per_core.append(round(attempts / seconds) if seconds else None)
+        seconds = perf_counter() - start
+
+        block = self.new_block(proof, timestamp=candidate['timestamp'])
+        self.mining_report = {
+            'difficulty': difficulty,
+            'proof': proof,
+            'seconds': round(seconds, 3),
+            'hashes per second': round(sum(h for h in per_core if h)),
+            'hashes per second per core': per_core,
+        }
+        return block
+
+
+    def get_proof(self, block_index, tx_index):
+        '''
+        merkle proof that a transaction is in a block. with the proof and
+        the block's merkle_root, a light client can check the transaction
+        without downloading the whole block (see verify_proof).
+
+        inputs:
+            block_index: {int} the 'index' of the block
+            tx_index: {int} position of the transaction in the block
+        return:
+            list of [sibling hash, side], O(log n) long
+        '''
+        tree = self.trees.get(block_index)
+        if tree is None:
+            # not cached: build it from the block's transactions
+            tree = MerkleTree(self.chain[block_index - 1]['transactions'])
+        self._cache_tree(block_index, tree)
+        return tree.proof(tx_index)
+
+
+    def _cache_tree(self, block_index, tree):
+        ''' keep the tree of a block, dropping the least recently used past TREE_CACHE trees '''
+        self.trees[block_index] = tree
+        self.trees.move_to_end(block_index)
+        if len(self.trees) > self.TREE_CACHE:
+            self.trees.popitem(last=False)
+
+
+    @property
+    def ledger(self):
+        ''' the ledger of the chain, read from the blocks the first time it is used '''
+        if self._ledger is None:
+            ledger = Ledger()
+            for block in self.chain:
+                ledger.add_block(block)
+            for position, transaction in enumerate(self.pending_transactions):
+                ledger.add_pending(transaction, position)
+            self._ledger = ledger
+        return self._ledger
+
+
+    def balance(self, account):
+        ''' coins of an account in the blocks so far (not counting the mempool) '''
+        return self.ledger.balances.get(account, 0)
+
+
+    def history(self, account):
+        '''
+        transactions of an account, oldest first.
+
+        inputs:
+            account: {str} the account
+        return:
+            list of (block index, transaction)
+        '''
+        ledger = self.ledger
+        # a transaction to oneself is in both lists
+        positions = sorted(set(ledger.sent.get(account, []) + ledger.received.get(account, [])))
+        history = []
+        block = None
+        for block_index, position in positions:
+            if block is None or block['index'] != block_index:
+                block = self.chain[block_index - 1]
+            history.append((block_index, block['transactions'][position]))
+        return history
+
+
+    def pending_from(self, sender):
+        ''' transactions from sender waiting in the mempool '''
+        return [self.pending_transactions[i] for i in self.ledger.pending.get(sender, [])]
+
+
+    @staticmethod
+    def verify_proof(transaction, proof, merkle_root):
+        ''' True if the proof shows the transaction is under this merkle root '''
+        return MerkleTree.verify(transaction, proof, merkle_root)
+
+
+    def export_json(self, indent=None):
+        ''' the chain as json, for people and other programs to read '''
+        return json.dumps(list(self.chain), indent=indent)
+
+
+    def verify_chain(self, from_index=None):
+        '''
+        check that the blocks have not been tampered with: each block's
+        stored hash must match its content, its transactions must match its
+        merkle root, and its hash must be the previous_hash of the next block.
+
+        only the blocks added since the last successful check are checked,
+        unless from_index is given.
+
+        inputs:
+            from_index: {int} position in the chain to start checking from (optional)
+        return:
+            True if the chain is valid
+        '''
+        start = self.verified_upto if from_index is None else from_index
+        if start > 0 and start < len(self.chain) and \
+                self.chain[start]['previous_hash'] != self.chain[start - 1]['hash']:
+            return False
+        if _check_range(self.chain, start, len(self.chain)) is not None:
+            return False
+
+        # everything up to here is known to be good
+        self.verified_upto = len(self.chain)
+        return True
+
+
+    def validate(self, workers=None, chunks_per_worker=4):
+        '''
+        check the whole chain like verify_chain, with the blocks shared out
+        between processes.
+
+        the chain is cut into ranges, each process checks the blocks of a
+        range and the links inside it, and returns the previous_hash of its
+        first block and the hash of its last block, so the links between
+        ranges are checked here.
+
+        inputs:
+            workers: {int} number of processes (optional, default: one per core)
+            chunks_per_worker: {int} ranges per process, so a slow range does not hold up the rest
+        return:
+            position in the chain of the first invalid block, or None if the chain is valid
+        '''
+        n_blocks = len(self.chain)
+        workers = workers or os.cpu_count() or 1
+        n_ranges = min(n_blocks, workers * chunks_per_worker)
+        if workers == 1 or n_ranges < 2:
+            first_invalid = _check_range(self.chain, 0, n_blocks)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            bounds = [n_blocks * k // n_ranges for k in range(n_ranges + 1)]
+            # with fork the processes share the chain instead of receiving a copy
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                     initializer=_set_worker_chain, initargs=(self.chain,)) as pool:
+                ranges = list(pool.map(_check_worker_range, bounds[:-1], bounds[1:]))
+
+            first_invalid = None
+            last_hash = None
+            for start, (bad, first_previous_hash, range_last_hash) in zip(bounds, ranges):
+                if last_hash is not None and first_previous_hash != last_hash:
+                    first_invalid = start
+                    break
+                if bad is not None:
+                    first_invalid = bad
+                    break
+                last_hash = range_last_hash
+
+        if first_invalid is None:
+            self.verified_upto = n_blocks
+        return first_invalid
+
+
+def _check_range(chain, start, stop):
+    '''
+    check the blocks chain[start:stop]: hash, merkle root, and the links
+    between them (not the link of the first one to the block before).
+
+    return:
+        position of the first invalid block, or None
+    '''
+    previous_hash = None
+    for i in range(start, stop):
+        block = chain[i]
+        if hashlib.sha256(encode_header(block)).hexdigest() != block['hash']:
+            return i
+        if MerkleTree(block['transactions']).root != block['merkle_root']:
+            return i
+        if previous_hash is not None and block['previous_hash'] != previous_hash:
+            return i
+        previous_hash = block['hash']
+    return None
+
+
+# the chain being checked by Blockchain.validate, in a worker process
+_worker_chain = None
+
+
+def _set_worker_chain(chain):
+    global _worker_chain
+    _worker_chain = chain
+
+
+def _check_worker_range(start, stop):
+    '''
+    check one range of the chain, this runs in a worker process.
+
+    return:
+        (first invalid position or None, previous_hash of the first block, hash of the last block)
+    '''
+    chain = _worker_chain
+    return _check_range(chain, start, stop), chain[start]['previous_hash'], chain[stop - 1]['hash']
+
+
+def _search_proofs(prefix, difficulty, start, step, found, results, chunk=20000):
+    '''
+    look for a proof of work, this runs in a worker process.
+
+    tries the proofs start, start + step, start + 2 * step, ... until one
+    gives a hash with `difficulty` leading zero hex digits, or until
+    another worker sets `found`. sends (proof or None, attempts, seconds)
+    to the results connection.
+    '''
+    base = hashlib.sha256(prefix)
+    pack_proof = _PROOF.pack
+    # compare the raw digest: whole zero bytes, then one zero half byte
+    zero_bytes, half_byte = divmod(difficulty, 2)
+    target = bytes(zero_bytes)
+
+    began = perf_counter()
+    proof = start
+    attempts = 0
+    while not found.is_set():
+        for _ in range(chunk):
+            attempt = base.copy()
+            attempt.update(pack_proof(proof))
+            digest = attempt.digest()
+            if digest[:zero_bytes] == target and (not half_byte or digest[zero_bytes] < 16):
+                found.set()
+                results.send((proof, attempts + 1, perf_counter() - began))
+                return
+            proof += step
+            attempts += 1
+    results.send((None, attempts, perf_counter() - began))
+
+
+def _collect_reports(processes, receivers, found):
+    '''
+    wait for the report of every mining worker, on its connection or on its
+    process sentinel, so a worker that dies is noticed instead of waited
+    for forever.
+
+    return:
+        reports: {list} (proof or None, attempts, seconds) of each worker
+    raises:
+        RuntimeError if a worker exits without a report (the others are stopped)
+    '''
+    reports = []
+    pending = dict(zip(receivers, processes))
+    try:
+        while pending:
+            ready = wait(list(pending) + [process.sentinel for process in pending.values()])
+            for receiver, process in list(pending.items()):
+                if receiver not in ready and process.sentinel not in ready:
+                    continue
+                # a report sent just before the exit is still in the pipe. the
+                # other workers may hold the sending end too, so a dead worker
+                # is not seen as the end of its pipe: check for data instead
+                try:
+                    if not receiver.poll():
+                        raise EOFError
+                    reports.append(receiver.recv())
+                except EOFError:
+                    process.join()
+                    raise RuntimeError(f'mining worker {process.name} exited with code '
+                                       f'{process.exitcode} without a report') from None
+                del pending[receiver]
+    finally:
+        # stops the other workers when one failed
+        found.set()
+        for process in processes:
+            process.join()
+        for receiver in receivers:
+            receiver.close()
+    return reports
+
+
 def main():
     blockchain = Blockchain()
     t1 = blockchain.new_transaction('flef', 'juan', '5 possy coin')
@@ -115,7 +937,33 @@ def main():
     t6 = blockchain.new_transaction('juan', 'juepetto', '1 possy coin')
     blockchain.new_block(6789)
 
-    print('blockchain:', blockchain.chain)
+    t7 = blockchain.new_transaction('big_jase', 'flef', '1 possy coin')
+    blockchain.mine(difficulty=4)
+    print('mining:', blockchain.mining_report)
 
-
-main()
+    print('blockchain:', blockchain.chain)
+    print('valid:', blockchain.verify_chain())
+
+    # a light client only needs the transaction, the proof and the block's merkle root
+    proof = blockchain.get_proof(3, 1)
+    print('proof for transaction 1 of block 3:', proof)
+    print('proof valid:', Blockchain.verify_proof(
+        blockchain.chain[2]['transactions'][1], proof, blockchain.chain[2]['merkle_root']))
+
+    print('balances:', blockchain.ledger.balances)
+    print('juan:', blockchain.history('juan'))
+
+    # the same chain kept on disk
+    import tempfile
+    with tempfile.TemporaryDirectory() as folder:
+        store = ChainStore(os.path.join(folder, 'chain'))
+        for block in blockchain.chain:
+            store.append(block)
+        store.close()
+        stored = Blockchain(ChainStore(os.path.join(folder, 'chain')))
+        print('stored blocks:', len(stored.chain), 'last block matches:', stored.last_block == blockchain.last_block)
+        stored.chain.close()
+
+
+if __name__ == '__main__':
+    main()
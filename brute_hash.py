@@ -2,26 +2,24 @@
 
 from hashlib import sha256
 
+from brute_hash_search import search_prefix
+
 message1 = "This is the input message blah blah"
 message2 = "This is the input message blah blaG"
 
 
-def hash_it_up(message:str):
+def hash_it_up(message:str, workers:int=None):
     ''' Brute force a sha256 hash to find a number that matches the first 3 characters of the hash of the input message.'''
     hashed = sha256(message.encode()).hexdigest()
     print(hashed)
 
-    x = 0
-
-    while True:
-        x += 1
-        attempt = sha256(str(x).encode()).hexdigest()
-        if attempt[:3] == hashed[:3]:
-            print(attempt)
-            print(f'Cracked after {x} attempts')
-            break
+    # the numbers are shared out between processes, see brute_hash_search.py
+    found = search_prefix(hashed, 3, workers=workers)
+    print(found['hash'])
+    print(f"Cracked after {found['number']} attempts ({found['attempts per second']} attempts/second)")
 
 
-hash_it_up(message1)
-hash_it_up(message2)
+if __name__ == '__main__':
+    hash_it_up(message1)
+    hash_it_up(message2)
 
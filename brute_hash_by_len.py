@@ -1,35 +1,70 @@
 #!/usr/bin/env python3
 
+import argparse
 from hashlib import sha256
 
+from brute_hash_search import search_prefix
+
 message1 = "This is the input message blah blah"
 message2 = "This is the input message blah blaG"
 
 
-def hash_it_up(message, fist_char):
+def print_progress(progress):
+    ''' one line of progress of a long search '''
+    eta = progress['eta seconds']
+    eta = f'{eta // 3600}h{eta % 3600 // 60:02}m{eta % 60:02}s' if eta is not None else '?'
+    print(f"{progress['attempts']:,} attempts ({progress['fraction done']:.1%} of the expected "
+          f"{progress['expected attempts']:,}), {progress['attempts per second']:,}/s, eta {eta}", flush=True)
+
+
+def hash_it_up(message, fist_char, workers=None, checkpoint=None, resume=True, progress=True):
     hashed = sha256(message.encode()).hexdigest()
     print(hashed)
 
-    x = 0
+    # the numbers are shared out between processes, see brute_hash_search.py.
+    # with a checkpoint file the search can be stopped and started again.
+    # progress is printed every few seconds, so only long searches show it.
+    found = search_prefix(hashed, fist_char, workers=workers, checkpoint=checkpoint, resume=resume,
+                          progress=print_progress if progress else None)
+    attempt = found['hash']
+    print(attempt)
+    print(f"Cracked after {found['number']} attempts ({found['attempts per second']} attempts/second)")
+    return attempt
+
+
+def main():
+    parser = argparse.ArgumentParser(description='find a number whose sha256 starts like the hash of a message')
+    parser.add_argument('--message', default=message1)
+    parser.add_argument('--chars', type=int, default=None,
+                        help='number of hex characters to match (default: the 2 and 3 character demo)')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: one per core)')
+    parser.add_argument('--checkpoint', default=None,
+                        help='json file to save the search to, and carry on from if it exists')
+    parser.add_argument('--fresh', action='store_true', help='ignore an existing checkpoint file')
+    parser.add_argument('--quiet', action='store_true', help='do not print the progress')
+    args = parser.parse_args()
+
+    if args.chars is not None:
+        try:
+            hash_it_up(args.message, args.chars, args.workers, args.checkpoint, not args.fresh, not args.quiet)
+        except KeyboardInterrupt:
+            if args.checkpoint:
+                print(f'stopped, run again with --checkpoint {args.checkpoint} to carry on')
+        return
 
-    while True:
-        x += 1
-        attempt = sha256(str(x).encode()).hexdigest()
-        if attempt[:fist_char] == hashed[:fist_char]:
-            print(attempt)
-            print(f'Cracked after {x} attempts')
-            return attempt
+    # hash_it_up(message1)
+    # hash_it_up(message2)
 
+    # now same message
+    x = hash_it_up(args.message, 2, args.workers)
+    y = hash_it_up(args.message, 3, args.workers)
 
-# hash_it_up(message1)
-# hash_it_up(message2)
+    print(x)
+    print(y)
 
-# now same message
-x = hash_it_up(message1, 2)
-y = hash_it_up(message1, 3)
 
-print(x)
-print(y)
+if __name__ == '__main__':
+    main()
 
 
 
@@ -0,0 +1,249 @@
+'''
+search engine for brute_hash.py and brute_hash_by_len.py
+
+find the smallest number x (from 1) whose sha256(str(x)) starts with the
+same hex characters as a target hash.
+
+ - the numbers are shared out between processes in batches: worker k
+   takes the batches k, k + workers, k + 2 * workers, ...
+ - the first worker to find a match writes it to a shared value, the
+   others stop once their next batch starts after it (a batch in
+   progress is finished, so the smallest match still wins)
+ - the comparison is on the raw digest: whole bytes, then one half byte
+   for an odd number of characters, no hexdigest per attempt
+ - the candidate is formatted straight to bytes (b'%d' % x)
+
+long searches (6 to 8 characters can take hours) can keep a checkpoint:
+every few seconds the next batch of each worker (its frontier) is saved
+to a small json file, and a search started with the same file carries
+on from there, on this machine or another one. a search stopped by
+Ctrl-C, SIGINT or SIGTERM stops its workers and saves the checkpoint
+before it raises KeyboardInterrupt. progress and an ETA,
+against the 16^k attempts expected for k characters, can be streamed
+through a callback.
+
+'''
+
+import os
+import json
+import signal
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+from hashlib import sha256
+from time import perf_counter
+
+
+# no match found yet
+_NONE = 2**63 - 1
+
+
+def prefix_matcher(target_hex:str, n_chars:int):
+    '''
+    a function digest -> True if the digest starts with the first
+    n_chars hex characters of target_hex.
+    '''
+    prefix = target_hex[:n_chars].lower()
+    zero_bytes, half_byte = divmod(len(prefix), 2)
+    target = bytes.fromhex(prefix[:2 * zero_bytes])
+    if half_byte:
+        nibble = int(prefix[-1], 16)
+        return lambda digest: digest[:zero_bytes] == target and digest[zero_bytes] >> 4 == nibble
+    return lambda digest: digest[:zero_bytes] == target
+
+
+def _search_batches(target_hex, n_chars, k, batch, step, best, frontier, attempts, stop=None):
+    '''
+    check the batches frontier[k], frontier[k] + step, ... (numbers of
+    `batch` each), this runs in a worker process.
+
+    best: shared value, the smallest match found so far
+    frontier: shared array, frontier[k] is the first batch this worker has not finished
+    attempts: shared array, attempts[k] is the attempts made by this worker
+    stop: shared value, set by the parent when the search is stopped (optional)
+    '''
+    matches = prefix_matcher(target_hex, n_chars)
+    start = frontier[k]
+    try:
+        while start < best.value and not (stop is not None and stop.value):
+            for x in range(start, start + batch):
+                if matches(sha256(b'%d' % x).digest()):
+                    attempts[k] += x - start + 1
+                    with best.get_lock():
+                        if x < best.value:
+                            best.value = x
+                    break
+            else:
+                attempts[k] += batch
+            start += step
+            frontier[k] = start
+    except KeyboardInterrupt:
+        # the parent saves the checkpoint
+        pass
+
+
+def read_checkpoint(path:str)->dict:
+    ''' the saved state of a search, or None if there is no checkpoint file '''
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path:str, state:dict):
+    ''' save the state of a search, the old file is only replaced once the new one is written '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def expected_attempts(n_chars:int)->int:
+    ''' on average a prefix of n_chars hex characters needs 16^n_chars attempts '''
+    return 16 ** n_chars
+
+
+def estimate(attempts:int, rate:float, n_chars:int)->dict:
+    '''
+    progress of a search against the expected number of attempts.
+
+    args:
+        attempts (int): attempts so far
+        rate (float): attempts per second
+        n_chars (int): number of hex characters searched for
+
+    return:
+        dict with the fraction of the expected attempts done and the
+        seconds left (0 once the search runs longer than expected)
+    '''
+    expected = expected_attempts(n_chars)
+    return {
+        'expected attempts': expected,
+        'fraction done': round(attempts / expected, 4),
+        'eta seconds': round(max(0, expected - attempts) / rate) if rate else None,
+    }
+
+
+def search_prefix(target_hex:str, n_chars:int, workers:int=None, batch:int=20000, start:int=1,
+                  checkpoint:str=None, resume:bool=True, checkpoint_seconds:float=30,
+                  progress=None, progress_seconds:float=5)->dict:
+    '''
+    find the smallest number from `start` whose sha256 has the same first
+    n_chars hex characters as target_hex.
+
+    args:
+        target_hex (str): hash to match, as hex
+        n_chars (int): number of hex characters to match
+        workers (int): number of processes (default: one per core)
+        batch (int): numbers given to a worker at a time
+        start (int): first number to try
+        checkpoint (str): json file the search state is saved to (optional)
+        resume (bool): carry on from the checkpoint file if there is one
+        checkpoint_seconds (float): time between two saves of the checkpoint
+        progress (callable): called with a dict of attempts, speed and ETA (optional)
+        progress_seconds (float): time between two calls of progress
+
+    return:
+        dict with the number, its hash, attempts, seconds and attempts per second
+    '''
+    workers = workers or os.cpu_count() or 1
+    target_hex = target_hex.lower()
+    frontiers = [start + k * batch for k in range(workers)]
+    attempts_before, seconds_before = 0, 0.0
+
+    state = read_checkpoint(checkpoint) if checkpoint and resume else None
+    if state is not None and (state['target'], state['chars']) != (target_hex[:n_chars], n_chars):
+        raise ValueError(f'{checkpoint} is the checkpoint of another search')
+    if state is not None:
+        attempts_before, seconds_before = state['attempts'], state['seconds']
+        if state['number'] is not None:
+            # already found
+            return _result(state['number'], attempts_before, seconds_before)
+        if len(state['frontier']) == workers and state['batch'] == batch:
+            frontiers = state['frontier']
+        else:
+            # another layout: every number below the lowest frontier is done
+            low = min(state['frontier'])
+            frontiers = [low + k * batch for k in range(workers)]
+
+    context = multiprocessing.get_context()
+    best = context.Value('q', _NONE)
+    frontier = context.Array('q', frontiers, lock=False)
+    attempts = context.Array('q', workers, lock=False)
+    # set when the search is stopped, the workers finish their batch and return
+    stop = context.Value('b', 0, lock=False)
+    began = perf_counter()
+
+    def save():
+        number = best.value if best.value != _NONE else None
+        write_checkpoint(checkpoint, {
+            'target': target_hex[:n_chars],
+            'chars': n_chars,
+            'batch': batch,
+            'frontier': list(frontier),
+            'attempts': attempts_before + sum(attempts),
+            'seconds': round(seconds_before + perf_counter() - began, 3),
+            'number': number,
+        })
+
+    if workers == 1 and checkpoint is None and progress is None:
+        # no need for another process
+        _search_batches(target_hex, n_chars, 0, batch, batch, best, frontier, attempts)
+    else:
+        processes = [context.Process(target=_search_batches, daemon=True,
+                                     args=(target_hex, n_chars, k, batch, workers * batch,
+                                           best, frontier, attempts, stop))
+                     for k in range(workers)]
+        for process in processes:
+            process.start()
+        # a scheduler stops a job with SIGTERM, handle it like Ctrl-C
+        # (signal handlers can only be set from the main thread)
+        handle_sigterm = threading.current_thread() is threading.main_thread()
+        if handle_sigterm:
+            old_handler = signal.signal(signal.SIGTERM, _interrupt)
+        last_save = last_progress = perf_counter()
+        try:
+            while any(process.is_alive() for process in processes):
+                wait([process.sentinel for process in processes], min(checkpoint_seconds, progress_seconds))
+                now = perf_counter()
+                if checkpoint and now - last_save >= checkpoint_seconds:
+                    save()
+                    last_save = now
+                if progress and now - last_progress >= progress_seconds:
+                    done = sum(attempts)
+                    rate = done / (now - began)
+                    progress(dict({'attempts': attempts_before + done,
+                                   'attempts per second': round(rate),
+                                   'frontier': min(frontier)},
+                                  **estimate(attempts_before + done, rate, n_chars)))
+                    last_progress = now
+        finally:
+            # a signal sent to this process only does not reach the workers
+            stop.value = 1
+            for process in processes:
+                process.join()
+            if handle_sigterm:
+                signal.signal(signal.SIGTERM, old_handler)
+            if checkpoint:
+                save()
+
+    return _result(best.value, attempts_before + sum(attempts), seconds_before + perf_counter() - began)
+
+
+def _interrupt(signum, frame):
+    ''' SIGTERM handler, stop the search the same way as Ctrl-C '''
+    raise KeyboardInterrupt(f'signal {signum}')
+
+
+def _result(number, attempts, seconds):
+    ''' the result of a search (attempts and seconds include the runs before a resume) '''
+    return {
+        'number': number,
+        'hash': sha256(b'%d' % number).hexdigest(),
+        'attempts': attempts,
+        'seconds': round(seconds, 4),
+        'attempts per second': round(attempts / seconds) if seconds else None,
+    }
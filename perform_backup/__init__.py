@@ -0,0 +1,3 @@
+''' back up the files of a folder that are newer than a cut off date '''
+
+from .main_backup import run_backup, cli
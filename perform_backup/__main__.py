@@ -0,0 +1,5 @@
+''' run a backup from the command line: python -m perform_backup --help '''
+
+from .main_backup import cli
+
+cli()
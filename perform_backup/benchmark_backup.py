@@ -0,0 +1,261 @@
+'''
+
+benchmark of the backup modes in `main_backup` on synthetic source trees.
+
+a source tree of each shape is generated in a temporary folder:
+ - deep: long chains of nested folders with a few files each
+ - wide: many folders side by side
+ - tiny: many very small files
+ - huge: a few big files
+
+a fraction of the files is dated before the cut off date. each backup
+mode (count only, serial copy, thread pool, dedup, gzip archive) is run
+on each tree in a fresh process, and the files per second, MB per
+second, read/write syscalls (from /proc/self/io, linux only) and peak
+RSS are recorded.
+
+every run is appended to a json history file (benchmark_history.json by
+default) and compared with the previous run, so regressions show up.
+
+usage:
+    python benchmark_backup.py [--scale 1.0] [--newer 0.5] [--history FILE]
+
+'''
+
+# %%
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import main_backup
+
+
+# shape -> (top level folders, depth of nested folders below each of them,
+#           files per folder, file size in bytes)
+SHAPES = {
+    'deep': (4, 30, 5, 4 * 2**10),
+    'wide': (400, 1, 10, 4 * 2**10),
+    'tiny': (20, 2, 100, 100),
+    'huge': (2, 1, 2, 32 * 2**20),
+}
+
+# mode -> settings used for run_backup (None: count the files only)
+MODES = {
+    'count': None,
+    'serial': {'workers': 1},
+    'threads': {'workers': 8, 'worker type': 'thread'},
+    'dedup': {'workers': 1, 'dedup': True},
+    'archive': {'mode': 'archive', 'archive compression': 'gzip'},
+}
+
+CUTOFF_DATE = '2022-01-01'
+
+
+def main():
+    ''' the main module '''
+    parser = argparse.ArgumentParser(description='benchmark the backup modes')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the number of files by this (default 1.0)')
+    parser.add_argument('--newer', type=float, default=0.5,
+                        help='fraction of files newer than the cut off date (default 0.5)')
+    parser.add_argument('--shapes', nargs='+', default=list(SHAPES), choices=list(SHAPES))
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--history', default='benchmark_history.json',
+                        help='json file the results are appended to')
+    args = parser.parse_args()
+
+    run = {
+        'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'scale': args.scale,
+        'newer fraction': args.newer,
+        'results': run_benchmark(args.shapes, args.modes, args.scale, args.newer),
+    }
+
+    history = read_history(args.history)
+    compare(run, history)
+    history.append(run)
+    with open(args.history, 'w') as f:
+        json.dump(history, f, indent=4)
+
+
+def make_tree(folder:str, shape:str, scale:float=1.0, newer:float=0.5, seed:int=0):
+    '''
+    generate a synthetic source tree.
+
+    args:
+        folder (str): folder the tree is created in
+        shape (str): one of SHAPES
+        scale (float): multiply the number of files per folder by this
+        newer (float): fraction of the files newer than the cut off date
+        seed (int): the same seed gives the same tree
+
+    return:
+        tuple of (number of files, total bytes)
+    '''
+    import random
+
+    tops, depth, files_per_folder, size = SHAPES[shape]
+    files_per_folder = max(1, round(files_per_folder * scale))
+    rng = random.Random(seed)
+    old_time = time.mktime(time.strptime(CUTOFF_DATE, "%Y-%m-%d")) - 86400
+    # half of the files repeat the same content, so dedup has something to do
+    shared = os.urandom(size)
+
+    # every folder of each chain holds files
+    all_folders = []
+    for top in range(tops):
+        rel_folder = f'top{top}'
+        all_folders.append(rel_folder)
+        for level in range(1, depth):
+            rel_folder = os.path.join(rel_folder, f'level{level}')
+            all_folders.append(rel_folder)
+
+    n_files = 0
+    for rel_folder in all_folders:
+        path = os.path.join(folder, rel_folder)
+        os.makedirs(path, exist_ok=True)
+        for i in range(files_per_folder):
+            file_path = os.path.join(path, f'f{i}.bin')
+            with open(file_path, 'wb') as f:
+                f.write(shared if rng.random() < 0.5 else os.urandom(size))
+            if rng.random() >= newer:
+                os.utime(file_path, (old_time, old_time))
+            n_files += 1
+
+    return n_files, n_files * size
+
+
+def _io_counters():
+    ''' read and write syscalls made by this process so far (linux only) '''
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['syscr']) + int(counters['syscw'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _peak_rss_mb():
+    ''' peak resident memory of this process, in MB '''
+    # VmHWM starts again at exec, ru_maxrss keeps the parent's peak on linux
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 2**10, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def run_case(source:str, destination:str, mode:str)->dict:
+    '''
+    run one backup mode on one tree, this runs in a fresh process so that
+    the peak memory belongs to this case only.
+    '''
+    syscalls_before = _io_counters()
+    start = time.perf_counter()
+    if MODES[mode] is None:
+        cutoff_date = time.mktime(time.strptime(CUTOFF_DATE, "%Y-%m-%d"))
+        files = main_backup.how_many_files(source, cutoff_date)
+        num_bytes = 0
+    else:
+        config = {
+            'source folder': source,
+            'destination folder': destination,
+            'cut off date': CUTOFF_DATE,
+            'manifest': False,
+            'resume': False,
+        }
+        config.update(MODES[mode])
+        result = main_backup.run_backup(config)
+        files = result['backed up files']
+        num_bytes = sum(w['bytes'] for w in result.get('workers', {}).values())
+        if 'archive' in result:
+            num_bytes = result['archive']['bytes in']
+    seconds = time.perf_counter() - start
+    syscalls_after = _io_counters()
+
+    return {
+        'files': files,
+        'seconds': round(seconds, 4),
+        'files per second': round(files / seconds, 1) if seconds else None,
+        'MB per second': round(num_bytes / 1e6 / seconds, 1) if seconds else None,
+        'read/write syscalls':
+            syscalls_after - syscalls_before if syscalls_before is not None else None,
+        'peak RSS MB': _peak_rss_mb(),
+    }
+
+
+def run_benchmark(shapes:list, modes:list, scale:float=1.0, newer:float=0.5)->dict:
+    '''
+    run each mode on each shape of tree.
+
+    return:
+        dict of shape -> mode -> measurements
+    '''
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as folder:
+        for shape in shapes:
+            source = os.path.join(folder, 'source')
+            n_files, num_bytes = make_tree(source, shape, scale, newer)
+            results[shape] = {'tree files': n_files, 'tree bytes': num_bytes}
+            for mode in modes:
+                destination = os.path.join(folder, 'destination')
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    results[shape][mode] = pool.submit(run_case, source, destination, mode).result()
+                shutil.rmtree(destination, ignore_errors=True)
+                print(f'{shape} {mode}: {json.dumps(results[shape][mode])}', file=sys.stderr)
+            shutil.rmtree(source)
+    return results
+
+
+def read_history(path:str)->list:
+    ''' previous runs of the benchmark (empty if there are none) '''
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def compare(run:dict, history:list, threshold:float=0.2):
+    '''
+    print the change in files per second against the previous run with
+    the same settings, flagging slowdowns bigger than `threshold`.
+    '''
+    previous = [old for old in history
+                if old['scale'] == run['scale'] and old['newer fraction'] == run['newer fraction']]
+    if not previous:
+        print('no previous run to compare with')
+        return
+    previous = previous[-1]
+    for shape, modes in run['results'].items():
+        for mode, measured in modes.items():
+            if not isinstance(measured, dict):
+                continue
+            old = previous['results'].get(shape, {}).get(mode)
+            if not old or not old.get('files per second') or not measured.get('files per second'):
+                continue
+            change = measured['files per second'] / old['files per second'] - 1
+            flag = '  <-- slower' if change < -threshold else ''
+            print(f'{shape:5} {mode:8} {measured["files per second"]:>10} files/s ({change:+.0%}){flag}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+'''
+
+benchmark of the copy primitives used by `main_backup.copy_file`.
+
+files of several sizes are written to a temporary folder and copied with
+`shutil.copy2` and with each zero-copy primitive available on this system
+(reflink, copy_file_range, sendfile). the throughput of each method for
+each file size bucket is printed as json.
+
+the temporary folder is on the local filesystem (see `tempfile`), set the
+TMPDIR environment variable to benchmark another one.
+
+'''
+
+# %%
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+from main_backup import ZERO_COPY_METHODS, copy_file
+
+
+# file size buckets (bytes) and the amount of data copied for each bucket
+SIZE_BUCKETS = [4 * 2**10, 64 * 2**10, 2**20, 16 * 2**20, 128 * 2**20]
+BYTES_PER_BUCKET = 256 * 2**20
+
+
+def main():
+    ''' the main module '''
+    results = run_benchmark(SIZE_BUCKETS, BYTES_PER_BUCKET)
+    print(json.dumps(results, indent=4))
+
+
+def run_benchmark(size_buckets:list, bytes_per_bucket:int)->dict:
+    '''
+    copy files of each size with each method and measure the throughput.
+
+    args:
+        size_buckets (list): file sizes in bytes
+        bytes_per_bucket (int): total bytes copied for each size
+
+    return:
+        dict of size bucket -> method -> throughput
+    '''
+    methods = ['copy2'] + list(ZERO_COPY_METHODS)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        for size in size_buckets:
+            n_files = max(1, bytes_per_bucket // size)
+            source = os.path.join(folder, 'source')
+            os.makedirs(source)
+            block = os.urandom(size)
+            paths = []
+            for i in range(n_files):
+                path = os.path.join(source, f'{i}.bin')
+                with open(path, 'wb') as f:
+                    f.write(block)
+                paths.append(path)
+
+            bucket = {}
+            for method in methods:
+                destination = os.path.join(folder, method)
+                os.makedirs(destination)
+                try:
+                    start = time.perf_counter()
+                    for i, path in enumerate(paths):
+                        dest_path = os.path.join(destination, f'{i}.bin')
+                        if method == 'copy2':
+                            shutil.copy2(path, dest_path)
+                        else:
+                            # threshold 0 so the method is used for every size
+                            used = copy_file(path, dest_path, 0, methods=[method])
+                            if used != method:
+                                raise OSError('not supported on this filesystem')
+                    seconds = time.perf_counter() - start
+                    bucket[method] = {
+                        'files': n_files,
+                        'seconds': round(seconds, 4),
+                        'files per second': round(n_files / seconds, 1),
+                        'MB per second': round(n_files * size / 1e6 / seconds, 1),
+                    }
+                except OSError as e:
+                    bucket[method] = {'error': str(e)}
+                shutil.rmtree(destination)
+
+            shutil.rmtree(source)
+            results[f'{size} bytes'] = bucket
+            print(f'{size} bytes: done', file=sys.stderr)
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
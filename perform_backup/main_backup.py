@@ -11,26 +11,73 @@ All files that are `newer` than the cutoff date are copied
 from the `source folder` to the `destination folder` maintaining the
 original tree structure of the `source folder`.
 
+The source folder is scanned once (`scan_source`) into a backup plan,
+which is then used for both the count and the copy. The time spent on
+the scan and on the copy is written to `results.json`.
+
+A manifest of the files already copied is kept in the destination folder
+(`.backup_manifest`), so each run only copies files whose size or
+modification time changed since the last run.
+
+In dedup mode each unique file content is stored once, named by its
+sha256, under `.backup_store` in the destination folder and the original
+tree is rebuilt with hardlinks to the stored copies.
+
+Files are copied under a temporary name and renamed once complete, and
+every completed copy is appended to a journal (`.backup_journal`). If a
+run is interrupted, the next run replays the journal and skips the files
+that were already copied.
+
+Files bigger than the `zero copy threshold MB` input are copied with the
+fastest primitive the filesystem offers (a reflink clone, then
+`os.copy_file_range`, then `os.sendfile`), falling back to `shutil.copy2`.
+
+The backup can run without the gui, from cron for example:
+
+    python -m perform_backup --source SRC --destination DST --progress
+
+or from python with `run_backup(config)`, where config has the same keys
+as `inputs.json`. PySimpleGUI is only imported when the gui is opened.
+
+With `"mode": "archive"` the files are streamed into a single tar archive
+(compressed with gzip or zstd, optionally split into volumes) instead of
+a tree. The member index is written to `results.json` and next to the
+archive, and `restore_from_archive` uses it to restore a single file.
+
+`--watch` (or `watch_backup`) keeps the destination up to date after the
+backup, using inotify on linux and a poll of the folders elsewhere.
+
 '''
 
 # %%
 
 import shutil
 import os
+import sys
 import time
 from datetime import datetime
 import json
+import tempfile
+import hashlib
+import errno
+import mmap
+import struct
+import threading
+from array import array
+from typing import NamedTuple
 
-import PySimpleGUI as sg
+try:
+    import fcntl
+except ImportError:
+    # not available on windows, so no reflink clones
+    fcntl = None
 
 
 def main():
     ''' the main module '''
 
     # inputs file is in the same directory as the program
-    path = os.path.abspath(__file__)
-    path = os.path.dirname(path)
-    input_file_path = os.path.join(path, 'inputs.json')
+    input_file_path = default_inputs_path()
     
     # read the data 
     initial_params = read_data(input_file_path)
@@ -41,10 +88,7 @@ def main():
     # Set the source and destination paths (suggestions)
     source = initial_params['source folder'] 
     destination = initial_params['destination folder']
-
-    # Set the cutoff date for new files (in seconds since the epoch)
     cutoff_date_string = initial_params['cut off date']
-    cutoff_date = time.mktime(time.strptime(cutoff_date_string, "%Y-%m-%d"))
 
     try:
         source, destination, cutoff_date = gui(
@@ -58,6 +102,72 @@ def main():
         print(e)
         return
 
+    config = dict(initial_params)
+    config['source folder'] = source
+    config['destination folder'] = destination
+    config['cut off date'] = datetime.fromtimestamp(cutoff_date).strftime("%Y-%m-%d")
+
+    result = run_backup(config)
+    print('the data is backed up:')
+    print(json.dumps(result, indent=4))
+    # write result to a json file
+    with open('results.json', 'w') as f:
+        json.dump(result, f, indent=4)
+
+
+def default_inputs_path():
+    ''' the inputs file is in the same directory as the program '''
+    path = os.path.abspath(__file__)
+    path = os.path.dirname(path)
+    return os.path.join(path, 'inputs.json')
+
+
+def run_backup(config:dict, progress=None)->dict:
+    '''
+    run a backup without the gui.
+
+    args:
+        config (dict): settings, with the same keys as `inputs.json`
+        progress: function called with a dict for each progress event (optional)
+
+    return:
+        a python dict with the result, as written to `results.json`
+    '''
+    # Set the source and destination paths
+    source = config['source folder']
+    destination = config['destination folder']
+
+    # Set the cutoff date for new files (in seconds since the epoch)
+    cutoff_date_string = config['cut off date']
+    cutoff_date = time.mktime(time.strptime(cutoff_date_string, "%Y-%m-%d"))
+
+    # number and type of copy workers (one worker copies serially)
+    workers = config.get('workers', 1)
+    worker_type = config.get('worker type', 'thread')
+
+    # keep a manifest in the destination so only changed files are copied
+    use_manifest = config.get('manifest', True)
+    hash_files = config.get('hash files', False)
+
+    # store identical files once and hardlink them into the tree
+    dedup = config.get('dedup', False)
+
+    # carry on from an interrupted run instead of starting again
+    resume = config.get('resume', True)
+
+    # files at least this big use the kernel zero-copy path
+    zero_copy_threshold = int(config.get('zero copy threshold MB', 1) * 2**20)
+
+    # 'mirror' copies the tree, 'archive' writes a single compressed tar
+    mode = config.get('mode', 'mirror')
+    if mode not in ('mirror', 'archive'):
+        raise ValueError(f"mode must be 'mirror' or 'archive', not {mode!r}")
+    compression = config.get('archive compression', 'gzip')
+    volume_size = int(config.get('archive volume size MB', 0) * 2**20)
+
+    if progress is None:
+        progress = lambda event: None
+
     result = {}
     result['current time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     result['source folder'] = source
@@ -65,17 +175,153 @@ def main():
     dt = datetime.fromtimestamp(cutoff_date)
     result['cut off date'] = dt.strftime("%Y-%m-%d")
 
-    n = how_many_files(source, cutoff_date)
+    # scan the source folder once, both the count and the copy use the plan
+    scan_start = time.perf_counter()
+    manifest = Manifest(destination, mode) if use_manifest else None
+    # an archive is written in one go, so there is nothing to resume
+    journal = Journal(destination) if resume and mode == 'mirror' else None
+    plan = scan_source(source, cutoff_date, manifest=manifest, journal=journal)
+    scan_seconds = time.perf_counter() - scan_start
+
+    n = how_many_files(source, cutoff_date, plan=plan)
     # print(f"Backing up {n} new files.")
     result['files to backup'] = n
-    n = perform_backup(source, destination, cutoff_date)
+    result['files unchanged since last run'] = plan.unchanged
+    result['files copied by an interrupted run'] = plan.resumed
+    progress({'event': 'scan', 'files': n, 'bytes': plan.total_bytes,
+              'seconds': round(scan_seconds, 3)})
+
+    def copy_progress(files_done, bytes_done):
+        progress({'event': 'copy', 'files done': files_done, 'files total': n,
+                  'bytes done': bytes_done, 'bytes total': plan.total_bytes})
+
+    copy_start = time.perf_counter()
+    report = {}
+    if mode == 'archive':
+        n = archive_backup(source, destination, plan, compression=compression,
+                           volume_size=volume_size, report=report, manifest=manifest,
+                           progress=copy_progress)
+    else:
+        n = perform_backup(source, destination, cutoff_date, plan=plan,
+                           workers=workers, worker_type=worker_type, report=report,
+                           manifest=manifest, hash_files=hash_files, dedup=dedup,
+                           journal=journal, zero_copy_threshold=zero_copy_threshold,
+                           progress=copy_progress)
+    copy_seconds = time.perf_counter() - copy_start
+    plan.close()
+
     # print(f"Backup complete! {n} files copied.")
     result['backed up files'] = n
-    print('the data is backed up:')
-    print(json.dumps(result, indent=4))
-    # write result to a json file
-    with open('results.json', 'w') as f:
+    result['timing'] = {
+        'scan seconds': round(scan_seconds, 3),
+        'copy seconds': round(copy_seconds, 3),
+    }
+    result.update(report)
+    progress({'event': 'done', 'result': result})
+    return result
+
+
+def cli(argv:list=None):
+    '''
+    command line entry point, used by `python -m perform_backup`.
+
+    the settings are read from an inputs file (by default `inputs.json`)
+    and can be overridden by arguments. the gui is only opened (and
+    PySimpleGUI only imported) with `--gui`.
+
+    args:
+        argv (list): command line arguments (optional, default sys.argv)
+
+    return:
+        the result dict, or None if the gui was closed
+    '''
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m perform_backup',
+                                     description='back up the files newer than a cut off date')
+    parser.add_argument('--inputs', default=default_inputs_path(),
+                        help='json file with the settings (default: inputs.json)')
+    parser.add_argument('--source', help='source folder')
+    parser.add_argument('--destination', help='destination folder')
+    parser.add_argument('--cut-off-date', help='copy files newer than this date (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, help='number of copy workers')
+    parser.add_argument('--worker-type', choices=['thread', 'process'], help='type of copy worker')
+    parser.add_argument('--mode', choices=['mirror', 'archive'],
+                        help='copy the tree, or write a single compressed tar archive')
+    parser.add_argument('--compression', choices=['gzip', 'zstd', 'none'],
+                        help='compression of the archive')
+    parser.add_argument('--dedup', action='store_true', default=None,
+                        help='store identical files once and hardlink them')
+    parser.add_argument('--no-manifest', dest='manifest', action='store_false', default=None,
+                        help='copy every file newer than the cut off date')
+    parser.add_argument('--results', default='results.json',
+                        help='file the result is written to (default: results.json)')
+    parser.add_argument('--progress', action='store_true',
+                        help='write progress to stdout as json lines')
+    parser.add_argument('--watch', action='store_true',
+                        help='after the backup, keep copying files as they change (ctrl-c to stop)')
+    parser.add_argument('--gui', action='store_true', help='open the gui to edit the settings')
+    args = parser.parse_args(argv)
+
+    config = read_data(args.inputs) if os.path.exists(args.inputs) else {}
+    overrides = {
+        'source folder': args.source,
+        'destination folder': args.destination,
+        'cut off date': args.cut_off_date,
+        'workers': args.workers,
+        'worker type': args.worker_type,
+        'dedup': args.dedup,
+        'mode': args.mode,
+        'archive compression': args.compression,
+        'manifest': args.manifest,
+    }
+    config.update({key: value for key, value in overrides.items() if value is not None})
+
+    if args.gui:
+        source, destination, cutoff_date = gui(
+            config.get('source folder', ''),
+            config.get('destination folder', ''),
+            config.get('cut off date', ''))
+        if cutoff_date is None:
+            return None
+        config['source folder'] = source
+        config['destination folder'] = destination
+        config['cut off date'] = datetime.fromtimestamp(cutoff_date).strftime("%Y-%m-%d")
+
+    missing = [key for key in ('source folder', 'destination folder', 'cut off date') if key not in config]
+    if missing:
+        parser.error('missing settings: ' + ', '.join(missing))
+    try:
+        time.strptime(config['cut off date'], "%Y-%m-%d")
+    except ValueError:
+        parser.error(f"the cut off date must be YYYY-MM-DD, not {config['cut off date']!r}")
+
+    if args.progress:
+        def progress(event):
+            if event['event'] == 'done':
+                event = dict(event, result=_printable(event['result']))
+            print(json.dumps(event), flush=True)
+    else:
+        progress = None
+
+    try:
+        if args.watch:
+            # runs until interrupted, the result is the latency of the watch
+            result = watch_backup(config, progress=progress)
+        else:
+            result = run_backup(config, progress=progress)
+    except (NotADirectoryError, ValueError) as e:
+        # a missing source folder or a bad setting, not worth a traceback
+        parser.error(str(e))
+    if not args.progress:
+        print(json.dumps(_printable(result), indent=4))
+    with open(args.results, 'w') as f:
         json.dump(result, f, indent=4)
+    return result
+
+def _printable(result:dict)->dict:
+    ''' the result without the archive member index, which can be huge (it stays in the results file) '''
+    return {key: value for key, value in result.items() if key != 'archive index'}
 
 # %%
 
@@ -99,6 +345,9 @@ def read_data(input_file:str)->dict:
 
 # %%
 def gui(source, destination, cutoff_date):
+    # the gui toolkit is only imported when the gui is used
+    import PySimpleGUI as sg
+
     # Define the layout of the app
     layout = [[sg.Text("Enter the source file path:")],
             [sg.InputText(source)],
@@ -140,73 +389,1619 @@ def gui(source, destination, cutoff_date):
     return source_path, dest_path, cutoff_date
 
 
-def how_many_files(source:str, cutoff_date:str):
+# %%
+
+class PlanEntry(NamedTuple):
+    ''' a single file selected for backup '''
+    rel_path: str
+    size: int
+    mtime_ns: int
+
+
+class BackupPlan:
+    '''
+    the list of files to back up, built by a single scan of the source folder.
+
+    entries are held in memory until there are more than `max_in_memory`
+    of them, after that they are spilled to a temporary file (one json
+    record per line) so that memory stays flat on very large trees.
+
+    args:
+        source (str): path of the source folder
+        max_in_memory (int): number of entries kept in memory before spilling
+    '''
+
+    def __init__(self, source:str, max_in_memory:int=1_000_000):
+        self.source = source
+        self.max_in_memory = max_in_memory
+        self.total_bytes = 0
+        # files skipped because the manifest shows they are already backed up
+        self.unchanged = 0
+        # files skipped because the journal shows an interrupted run copied them
+        self.resumed = 0
+        # relative paths of the folders that hold at least one planned file
+        self.directories = set()
+        self._entries = []
+        self._count = 0
+        self._spill = None
+
+    def add(self, rel_path:str, size:int, mtime_ns:int):
+        ''' add a file to the plan '''
+        self._entries.append(PlanEntry(rel_path, size, mtime_ns))
+        self._count += 1
+        self.total_bytes += size
+        self.directories.add(os.path.dirname(rel_path))
+        if len(self._entries) >= self.max_in_memory:
+            self._flush()
+
+    def _flush(self):
+        ''' move the in-memory entries to the spill file '''
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+        for entry in self._entries:
+            self._spill.write(json.dumps(entry) + '\n')
+        self._entries = []
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        if self._spill is not None:
+            self._spill.seek(0)
+            for line in self._spill:
+                yield PlanEntry(*json.loads(line))
+            # the spill file is appended to at the end
+            self._spill.seek(0, os.SEEK_END)
+        yield from self._entries
+
+    def close(self):
+        ''' remove the spill file (if any) '''
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
+class Manifest:
+    '''
+    persistent record of the files already backed up, kept in the
+    destination folder as `.backup_manifest` (`.backup_manifest.archive`
+    for the archive mode, so the two modes never skip each other's files).
+
+    the file is a compact binary list of records (size, mtime_ns, relative
+    path and an optional content hash) sorted by path, followed by an index
+    of the record offsets. the file is memory mapped and a lookup is a
+    binary search of the index, so only the pages touched are read and the
+    memory used does not grow with the number of files. the files recorded
+    by this run are kept in a dict until `save` merges them with the old
+    records into a new file and swaps it in atomically.
+
+    args:
+        destination (str): path of the destination folder
+        mode (str): 'mirror' or 'archive', the mode the files are backed up in
+    '''
+
+    file_name = '.backup_manifest'
+    _magic = b'BKMANIF2'
+    # number of records, offset of the index
+    _header = struct.Struct('<QQ')
+    # size, mtime_ns, length of the path, length of the hash
+    _record = struct.Struct('<QqHB')
+    _offset = struct.Struct('<Q')
+
+    def __init__(self, destination:str, mode:str='mirror'):
+        file_name = self.file_name if mode == 'mirror' else f'{self.file_name}.{mode}'
+        self.path = os.path.join(destination, file_name)
+        # relative path -> (size, mtime_ns, hash) of the files recorded since the last save
+        self.changes = {}
+        # true once a file has been recorded since the manifest was read
+        self.changed = False
+        self._file = None
+        self._map = None
+        self._count = 0
+        self._index = 0
+        self.load()
+
+    def load(self):
+        ''' map the manifest file, if there is one '''
+        self.close()
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        magic = f.read(len(self._magic))
+        header = f.read(self._header.size)
+        if magic != self._magic or len(header) != self._header.size:
+            f.close()
+            raise ValueError(f'{self.path} is not a backup manifest')
+        self._count, self._index = self._header.unpack(header)
+        if self._count:
+            self._file = f
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            f.close()
+
+    def close(self):
+        ''' unmap the manifest file (the changes not saved yet are kept) '''
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._count = self._index = 0
+
+    def __len__(self):
+        ''' number of records in the file (not counting the changes not saved yet) '''
+        return self._count
+
+    def _read(self, i:int):
+        ''' the i-th record of the file, as (path bytes, size, mtime_ns, hash) '''
+        data = self._map
+        offset = self._offset.unpack_from(data, self._index + i * self._offset.size)[0]
+        size, mtime_ns, path_len, hash_len = self._record.unpack_from(data, offset)
+        offset += self._record.size
+        path_bytes = data[offset:offset + path_len]
+        return path_bytes, size, mtime_ns, data[offset + path_len:offset + path_len + hash_len]
+
+    def _find(self, path_bytes:bytes):
+        ''' binary search of the file for a path, the record or None '''
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            record = self._read(middle)
+            if record[0] == path_bytes:
+                return record
+            if record[0] < path_bytes:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def get(self, rel_path:str):
+        ''' the (size, mtime_ns, hash) recorded for a file, or None '''
+        entry = self.changes.get(rel_path)
+        if entry is None and self._count:
+            record = self._find(rel_path.encode('utf-8', 'surrogateescape'))
+            if record is not None:
+                entry = record[1:]
+        return entry
+
+    def unchanged(self, rel_path:str, size:int, mtime_ns:int):
+        ''' true if the file is already backed up with this size and time '''
+        entry = self.get(rel_path)
+        return entry is not None and entry[0] == size and entry[1] == mtime_ns
+
+    def update(self, rel_path:str, size:int, mtime_ns:int, digest:bytes=b''):
+        ''' record a file that has been backed up '''
+        self.changes[rel_path] = (size, mtime_ns, digest)
+        self.changed = True
+
+    def _merged(self):
+        ''' the records of the file and the changes, sorted by path (a change wins) '''
+        changes = sorted((rel_path.encode('utf-8', 'surrogateescape'), entry)
+                         for rel_path, entry in self.changes.items())
+        j = 0
+        for i in range(self._count):
+            record = self._read(i)
+            while j < len(changes) and changes[j][0] < record[0]:
+                yield (changes[j][0],) + changes[j][1]
+                j += 1
+            if j < len(changes) and changes[j][0] == record[0]:
+                yield (changes[j][0],) + changes[j][1]
+                j += 1
+            else:
+                yield record
+        for path_bytes, entry in changes[j:]:
+            yield (path_bytes,) + entry
+
+    def save(self):
+        ''' merge the changes into a temporary file and swap it in (only if something changed) '''
+        if not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        record = self._record
+        offsets = array('Q')
+        with open(tmp_path, 'wb') as f:
+            # the header is written again once the count and index are known
+            f.write(self._magic + self._header.pack(0, 0))
+            offset = f.tell()
+            for path_bytes, size, mtime_ns, digest in self._merged():
+                offsets.append(offset)
+                f.write(record.pack(size, mtime_ns, len(path_bytes), len(digest)))
+                f.write(path_bytes)
+                f.write(digest)
+                offset += record.size + len(path_bytes) + len(digest)
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            f.write(offsets.tobytes())
+            f.seek(len(self._magic))
+            f.write(self._header.pack(len(offsets), offset))
+            f.flush()
+            os.fsync(f.fileno())
+        # a mapped file cannot be replaced on windows
+        self.close()
+        os.replace(tmp_path, self.path)
+        self.changes = {}
+        self.changed = False
+        self.load()
+
+
+class Journal:
+    '''
+    write-ahead journal of the files copied by the current run, kept in
+    the destination folder as `.backup_journal`.
+
+    each completed copy is appended as one json line. when a run is
+    interrupted, the next run reads the journal back (this only costs
+    the size of the journal) and skips the files listed in it. a line
+    torn by the interruption is cut off before anything is appended. the
+    journal is removed when a run completes.
+
+    args:
+        destination (str): path of the destination folder
+    '''
+
+    file_name = '.backup_journal'
+
+    def __init__(self, destination:str):
+        self.path = os.path.join(destination, self.file_name)
+        # relative path -> (size, mtime_ns, hash) of the copies already done
+        self.entries = {}
+        # true if a journal was left by a run that did not finish
+        self.interrupted = False
+        self._file = None
+        self.replay()
+
+    def replay(self):
+        ''' read the journal left by an interrupted run, if there is one '''
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        self.interrupted = True
+        # end of the last complete line
+        good_offset = 0
+        with f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('line not finished')
+                    rel_path, size, mtime_ns, hex_digest = json.loads(line)
+                    digest = bytes.fromhex(hex_digest)
+                except ValueError:
+                    # the last line may be torn if the run was killed
+                    break
+                self.entries[rel_path] = (size, mtime_ns, digest)
+                good_offset += len(line)
+        if os.path.getsize(self.path) != good_offset:
+            # cut the torn line off, or the next record would be glued to it
+            os.truncate(self.path, good_offset)
+
+    def start(self):
+        '''
+        open the journal for this run. from now on the journal file exists
+        until finish(), so a run killed before its first record is still
+        seen as interrupted.
+        '''
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8', errors='surrogateescape')
+
+    def unchanged(self, rel_path:str, size:int, mtime_ns:int):
+        ''' true if this run already copied the file with this size and time '''
+        entry = self.entries.get(rel_path)
+        return entry is not None and entry[0] == size and entry[1] == mtime_ns
+
+    def record(self, copied:list):
+        '''
+        append completed copies to the journal and flush them to disk.
+
+        args:
+            copied (list): list of (PlanEntry, content hash)
+        '''
+        self.start()
+        for entry, digest in copied:
+            self._file.write(json.dumps([entry.rel_path, entry.size, entry.mtime_ns, digest.hex()]) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def finish(self):
+        ''' the run is complete, so the journal is no longer needed '''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.entries = {}
+
+
+def hash_file(path:str, algorithm:str='sha256', chunk_size:int=1 << 20):
+    '''
+    hash the content of a file, reading it in chunks.
+
+    args:
+        path (str): path of the file
+        algorithm (str): any hashlib algorithm
+        chunk_size (int): number of bytes read at a time
+
+    return:
+        the raw digest (bytes)
+    '''
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.digest()
+
+
+def scan_source(source:str, cutoff_date:float, max_in_memory:int=1_000_000,
+                manifest:Manifest=None, journal:Journal=None):
+    '''
+    scan the source folder once and build the backup plan.
+
+    uses os.scandir so the file type comes from the directory listing and
+    each file is stat-ed once only (the DirEntry caches the result).
+
+    args:
+        source (str): path of the source folder
+        cutoff_date (float): cut off date in seconds since the epoch
+        max_in_memory (int): number of plan entries kept in memory
+        manifest (Manifest): files already backed up, these are skipped (optional)
+        journal (Journal): files copied by an interrupted run, these are skipped (optional)
+
+    return:
+        a BackupPlan with the files that are newer than the cut off date
+    '''
+    if not os.path.isdir(source):
+        # otherwise a typo in the source would look like a backup of 0 files
+        raise NotADirectoryError(f'the source folder {source!r} does not exist or is not a folder')
+    plan = BackupPlan(source, max_in_memory)
+
+    # walk the tree with an explicit stack of (full path, relative path)
+    stack = [(source, '')]
+    while stack:
+        folder, rel_folder = stack.pop()
+        try:
+            entries = os.scandir(folder)
+        except OSError:
+            # same as os.walk: folders that cannot be listed are skipped
+            continue
+        with entries:
+            for entry in entries:
+                rel_path = os.path.join(rel_folder, entry.name) if rel_folder else entry.name
+                try:
+                    if entry.is_dir():
+                        # like os.walk, do not follow symlinks to folders
+                        if not entry.is_symlink():
+                            stack.append((entry.path, rel_path))
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    # broken links or files removed during the scan
+                    continue
+                # Check if the file was modified after the cutoff date
+                if st.st_mtime > cutoff_date:
+                    # Skip files that have not changed since the last run
+                    if manifest is not None and manifest.unchanged(rel_path, st.st_size, st.st_mtime_ns):
+                        plan.unchanged += 1
+                        continue
+                    if journal is not None and journal.unchanged(rel_path, st.st_size, st.st_mtime_ns):
+                        plan.resumed += 1
+                        continue
+                    plan.add(rel_path, st.st_size, st.st_mtime_ns)
+
+    return plan
+
+
+def how_many_files(source:str, cutoff_date:str, plan:BackupPlan=None):
     '''
     function to determine how many files need to be updated.
 
     args:
         source (str): path of the source folder
         cutoff_date (str): string of a date in this format "2022-01-01"
+        plan (BackupPlan): an existing scan of the source folder (optional)
 
     return:
         number of files that will be backed up
     '''
-    # Initialize a counter for the number of files to be backed up
-    num_files_to_backup = 0
-
-    # Use the os.walk() function to iterate over all files and directories in the source drive
-    for root, dirs, files in os.walk(source):
-        for file in files:
-            # Get the full path of the file
-            src_path = os.path.join(root, file)
-            # Get the modification time of the file
-            mtime = os.stat(src_path).st_mtime
-            # Check if the file was modified after the cutoff date
-            if mtime > cutoff_date:
-                # Increment the counter
-                num_files_to_backup += 1
+    if plan is None:
+        plan = scan_source(source, cutoff_date)
 
     # return the number of files to be backed up
-    return num_files_to_backup
+    return len(plan)
+
+
+# folder in the destination that holds the deduplicated file contents
+STORE_FOLDER = '.backup_store'
+
+# folder in the destination that holds the files that are still being copied
+STAGING_FOLDER = '.backup_staging'
+
+# suffix of files that are still being copied
+TMP_SUFFIX = '.backup_tmp'
+
+
+def make_directories(destination:str, directories):
+    '''
+    create each destination folder once, instead of once per file.
+
+    args:
+        destination (str): path of the destination folder
+        directories: relative paths of the folders to create
+    '''
+    # sorted so that parents are created before their children
+    for rel_dir in sorted(directories):
+        os.makedirs(os.path.join(destination, rel_dir), exist_ok=True)
+
+
+def remove_temporary_files(destination:str)->int:
+    '''
+    remove the partial copies left by a run that was killed. every copy is
+    written to the staging folder first, so only that folder is listed and
+    the rest of the destination is never touched.
+
+    args:
+        destination (str): path of the destination folder
+
+    return:
+        number of files removed
+    '''
+    removed = 0
+    try:
+        entries = os.scandir(os.path.join(destination, STAGING_FOLDER))
+    except FileNotFoundError:
+        return 0
+    with entries:
+        for entry in entries:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def _temporary_path(destination:str)->str:
+    '''
+    path in the staging folder that this worker copies to. a worker copies
+    one file at a time, so the process and thread ids make it unique.
+    '''
+    return os.path.join(destination, STAGING_FOLDER,
+                        f'{os.getpid()}.{threading.get_ident()}{TMP_SUFFIX}')
+
+
+def _worker_name():
+    ''' name of the thread or process doing the copy '''
+    import multiprocessing
+
+    process = multiprocessing.current_process().name
+    if process != 'MainProcess':
+        return process
+    return threading.current_thread().name
+
+
+# ioctl request that clones a whole file on btrfs, xfs and similar (linux)
+FICLONE = 0x40049409
+
+# largest request passed to copy_file_range and sendfile at a time
+_ZERO_COPY_CHUNK = 1 << 30
+
+
+def _reflink(src_fd:int, dst_fd:int):
+    ''' clone the file so source and destination share the same blocks '''
+    if fcntl is None:
+        raise OSError('reflink clones need fcntl')
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_file_range(src_fd:int, dst_fd:int):
+    ''' copy inside the kernel, may be offloaded to the filesystem or server '''
+    while os.copy_file_range(src_fd, dst_fd, _ZERO_COPY_CHUNK):
+        pass
+
+
+def _sendfile(src_fd:int, dst_fd:int):
+    ''' copy inside the kernel without passing the data through python '''
+    offset = 0
+    while sent := os.sendfile(dst_fd, src_fd, offset, _ZERO_COPY_CHUNK):
+        offset += sent
+
+
+# zero-copy primitives, fastest first
+ZERO_COPY_METHODS = {}
+if fcntl is not None:
+    ZERO_COPY_METHODS['reflink'] = _reflink
+if hasattr(os, 'copy_file_range'):
+    ZERO_COPY_METHODS['copy_file_range'] = _copy_file_range
+if hasattr(os, 'sendfile'):
+    ZERO_COPY_METHODS['sendfile'] = _sendfile
+
+# primitives that failed once are not tried again by this process
+_unsupported = set()
+
+# errors that mean a primitive does not work on this filesystem (or kernel),
+# anything else (a full disk, an i/o error) is a real failure of the copy
+_UNSUPPORTED_ERRORS = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                       getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP)}
 
 
-def perform_backup(source:str, destination:str, cutoff_date:str):
+def copy_file(src_path:str, dest_path:str, zero_copy_threshold:int=2**20, methods=None, size:int=None):
+    '''
+    copy a file and its metadata, like shutil.copy2.
+
+    files of at least `zero_copy_threshold` bytes are copied with the first
+    zero-copy primitive that works on this filesystem, smaller files (or
+    when none of them work) use shutil.copy2.
+
+    args:
+        src_path (str): path of the file to copy
+        dest_path (str): path of the copy
+        zero_copy_threshold (int): size in bytes from which zero-copy is tried
+        methods (list): names from ZERO_COPY_METHODS to try (optional, all of them)
+        size (int): size of the file in bytes, if known from the plan (optional)
+
+    return:
+        name of the method used
+    '''
+    if methods is None:
+        methods = [m for m in ZERO_COPY_METHODS if m not in _unsupported]
+    if methods and size is None:
+        size = os.stat(src_path).st_size
+    if not methods or size < zero_copy_threshold:
+        shutil.copy2(src_path, dest_path)
+        return 'copy2'
+
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dst:
+        for method in methods:
+            try:
+                ZERO_COPY_METHODS[method](src.fileno(), dst.fileno())
+                break
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_ERRORS:
+                    raise
+                # not supported here, start again with the next method
+                _unsupported.add(method)
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+        else:
+            shutil.copyfileobj(src, dst)
+            method = 'copy2'
+    shutil.copystat(src_path, dest_path)
+    return method
+
+
+class CopyOptions(NamedTuple):
+    ''' settings passed to every copy worker '''
+    hash_files: bool = False
+    dedup: bool = False
+    zero_copy_threshold: int = 2**20
+
+
+def _store_blob(src_path:str, store:str, hex_digest:str, zero_copy_threshold:int=2**20, size:int=None,
+                tmp_path:str=None):
+    '''
+    put a copy of a file in the content-addressed store.
+
+    the copy is made under tmp_path (default: next to the blob) and
+    renamed once complete.
+
+    return:
+        tuple of (path of the stored blob, true if the blob was new, copy method)
+    '''
+    blob_path = os.path.join(store, hex_digest[:2], hex_digest)
+    if os.path.exists(blob_path):
+        return blob_path, False, None
+    # copy under a temporary name so a partial blob is never used
+    if tmp_path is None:
+        tmp_path = f'{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    method = copy_file(src_path, tmp_path, zero_copy_threshold, size=size)
+    os.replace(tmp_path, blob_path)
+    return blob_path, True, method
+
+
+def _link_blob(blob_path:str, dest_path:str):
+    '''
+    hardlink a stored blob into the destination tree.
+
+    return:
+        true if a hardlink was made, false if the blob had to be copied
+    '''
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+    try:
+        os.link(blob_path, dest_path)
+        return True
+    except OSError:
+        # the filesystem does not support hardlinks
+        shutil.copy2(blob_path, dest_path)
+        return False
+
+
+def _copy_batch(source:str, destination:str, entries:list, options:CopyOptions=CopyOptions()):
+    '''
+    copy a batch of planned files, this runs inside a worker.
+
+    the destination folders (and the store folders in dedup mode) must
+    already exist. every file is copied to the staging folder first and
+    renamed into place once complete.
+
+    return:
+        a dict with the worker name, counts, timings and a list of
+        (entry, content hash) for the manifest
+    '''
+    start = time.perf_counter()
+    stats = {
+        'worker': _worker_name(),
+        'files': 0,
+        'bytes': 0,
+        'bytes saved': 0,
+        'bytes hashed': 0,
+        'hash seconds': 0.0,
+        'unique blobs': 0,
+        'copy methods': {},
+        'copied': [],
+    }
+    store = os.path.join(destination, STORE_FOLDER)
+    # copy under a temporary name so a partial file is never mistaken for done
+    tmp_path = _temporary_path(destination)
+    os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+    for entry in entries:
+        src_path = os.path.join(source, entry.rel_path)
+        dest_path = os.path.join(destination, entry.rel_path)
+        if options.dedup:
+            hash_start = time.perf_counter()
+            digest = hash_file(src_path)
+            stats['hash seconds'] += time.perf_counter() - hash_start
+            stats['bytes hashed'] += entry.size
+            blob_path, new_blob, method = _store_blob(src_path, store, digest.hex(),
+                                                      options.zero_copy_threshold, entry.size, tmp_path)
+            linked = _link_blob(blob_path, dest_path)
+            if new_blob:
+                stats['unique blobs'] += 1
+            elif linked:
+                stats['bytes saved'] += entry.size
+        else:
+            method = copy_file(src_path, tmp_path, options.zero_copy_threshold, size=entry.size)
+            os.replace(tmp_path, dest_path)
+            digest = hash_file(dest_path) if options.hash_files else b''
+        if method is not None:
+            stats['copy methods'][method] = stats['copy methods'].get(method, 0) + 1
+        stats['files'] += 1
+        stats['bytes'] += entry.size
+        stats['copied'].append((entry, digest))
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def _batches(plan, batch_size:int):
+    ''' split the plan into lists of at most batch_size entries '''
+    batch = []
+    for entry in plan:
+        batch.append(entry)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def perform_backup(source:str, destination:str, cutoff_date:str, plan:BackupPlan=None,
+                   workers:int=1, worker_type:str='thread', batch_size:int=64, report:dict=None,
+                   manifest:Manifest=None, hash_files:bool=False, dedup:bool=False,
+                   journal:Journal=None, zero_copy_threshold:int=2**20, progress=None):
     '''
     function to perform the backup
 
+    with more than one worker the files are copied by a pool of threads
+    (or processes). only a few batches per worker are queued at any time,
+    so memory stays flat however big the tree is.
+
+    when a manifest is given, it is updated with every file copied and
+    saved once the backup is complete. when a journal is given, every
+    completed batch is written to it and it is removed at the end.
+
+    in dedup mode every file is hashed in chunks and its content is stored
+    once under `.backup_store`, the destination tree is made of hardlinks
+    to the stored blobs (or copies where hardlinks are not supported).
+
     args:
         source (str): path of the source folder
         destination (str): path of the destination folder
         cutoff_date (str): string of a date in this format "2022-01-01"
+        plan (BackupPlan): an existing scan of the source folder (optional)
+        workers (int): number of copy workers
+        worker_type (str): 'thread' or 'process'
+        batch_size (int): number of files handed to a worker at a time
+        report (dict): filled with the throughput of each worker, and the
+            dedup savings in dedup mode (optional)
+        manifest (Manifest): record of the files backed up (optional)
+        hash_files (bool): store a sha256 of each file in the manifest
+        dedup (bool): store identical files once and hardlink them
+        journal (Journal): journal of completed copies, so that an interrupted
+            run can be resumed (optional)
+        zero_copy_threshold (int): files of at least this many bytes use the
+            kernel zero-copy path
+        progress: function called with (files done, bytes done) after
+            each batch (optional)
 
     return:
         number of files that will have backed up
 
     
     '''
-    # Initialize a counter for the number of files copied
-    num_files_copied = 0
-
-    # Use the shutil.copytree() function to copy the entire source 
-    # drive to the destination
-    for root, dirs, files in os.walk(source):
-        for file in files:
-            # Get the full path of the file
-            src_path = os.path.join(root, file)
-            # Get the modification time of the file
-            mtime = os.stat(src_path).st_mtime
-            # Check if the file was modified after the cutoff date
-            if mtime > cutoff_date:
-                # Calculate the relative path of the file
-                rel_path = os.path.relpath(src_path, source)
-                # Calculate the destination path of the file
-                dest_path = os.path.join(destination, rel_path)
-                # Create any necessary parent directories
-                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                # Copy the file to the destination
-                shutil.copy2(src_path, dest_path)
-                # Increment the counter
-                num_files_copied += 1
+    if plan is None:
+        plan = scan_source(source, cutoff_date, manifest=manifest, journal=journal)
+    if worker_type not in ('thread', 'process'):
+        raise ValueError(f"worker type must be 'thread' or 'process', not {worker_type!r}")
+
+    options = CopyOptions(hash_files=hash_files, dedup=dedup,
+                          zero_copy_threshold=zero_copy_threshold)
+
+    if journal is not None and manifest is not None:
+        # files copied by an interrupted run belong in the manifest too
+        for rel_path, (size, mtime_ns, digest) in journal.entries.items():
+            manifest.update(rel_path, size, mtime_ns, digest)
+
+    if journal is not None and journal.interrupted:
+        # partial copies of the interrupted run are never finished
+        remove_temporary_files(destination)
+
+    # Create the destination folders up front
+    make_directories(destination, plan.directories)
+    if journal is not None and len(plan):
+        journal.start()
+    if dedup and len(plan):
+        # the store is split over 256 folders by the first byte of the hash
+        make_directories(os.path.join(destination, STORE_FOLDER), (f'{i:02x}' for i in range(256)))
+
+    # per worker totals: name -> [files, bytes, seconds]
+    totals = {}
+    dedup_totals = {'bytes saved': 0, 'bytes hashed': 0, 'hash seconds': 0.0, 'unique blobs': 0}
+    copy_methods = {}
+
+    def collect(stats):
+        worker_totals = totals.setdefault(stats['worker'], [0, 0, 0.0])
+        worker_totals[0] += stats['files']
+        worker_totals[1] += stats['bytes']
+        worker_totals[2] += stats['seconds']
+        for key in dedup_totals:
+            dedup_totals[key] += stats[key]
+        for method, count in stats['copy methods'].items():
+            copy_methods[method] = copy_methods.get(method, 0) + count
+        if manifest is not None:
+            for entry, digest in stats['copied']:
+                manifest.update(entry.rel_path, entry.size, entry.mtime_ns, digest)
+        if journal is not None:
+            journal.record(stats['copied'])
+        if progress is not None:
+            progress(sum(t[0] for t in totals.values()), sum(t[1] for t in totals.values()))
+
+    if workers <= 1:
+        # copy serially in this thread
+        for batch in _batches(plan, batch_size):
+            collect(_copy_batch(source, destination, batch, options))
+    else:
+        # imported here so that a serial run starts faster
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+        pool_class = ThreadPoolExecutor if worker_type == 'thread' else ProcessPoolExecutor
+        max_pending = 2 * workers
+        with pool_class(max_workers=workers) as pool:
+            pending = set()
+            for batch in _batches(plan, batch_size):
+                # wait for a free slot so that the queue stays bounded
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future.result())
+                pending.add(pool.submit(_copy_batch, source, destination, batch, options))
+            for future in pending:
+                collect(future.result())
+
+    if manifest is not None:
+        manifest.save()
+    if journal is not None:
+        journal.finish()
+
+    if report is not None:
+        report['workers'] = {}
+        for name, (files, num_bytes, seconds) in sorted(totals.items()):
+            report['workers'][name] = {
+                'files': files,
+                'bytes': num_bytes,
+                'seconds': round(seconds, 3),
+                'MB per second': round(num_bytes / 1e6 / seconds, 3) if seconds else None,
+            }
+        report['copy methods'] = copy_methods
+        if dedup:
+            hash_seconds = dedup_totals['hash seconds']
+            report['dedup'] = {
+                'unique blobs': dedup_totals['unique blobs'],
+                'bytes saved': dedup_totals['bytes saved'],
+                'bytes hashed': dedup_totals['bytes hashed'],
+                'hashing MB per second':
+                    round(dedup_totals['bytes hashed'] / 1e6 / hash_seconds, 3) if hash_seconds else None,
+            }
 
     # return a success message with the number of files copied
-    return num_files_copied
+    return sum(worker_totals[0] for worker_totals in totals.values())
+
+
+# %%
+
+# name of the file, next to the archive volumes, that holds the member index
+ARCHIVE_INDEX_SUFFIX = '.index.json'
+
+# marker put on the compression queue to start a new compressed frame
+_NEW_FRAME = object()
+
+
+def _compressor(compression:str, level:int=None):
+    '''
+    make a compressor for one frame of the archive.
+
+    every frame is a complete gzip member or zstd frame, so reading can
+    start at the beginning of any frame.
+
+    return:
+        an object with compress(data) and flush() methods
+    '''
+    if compression == 'gzip':
+        import zlib
+        return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compression needs the 'zstandard' package") from None
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    if compression == 'none':
+        return _NoCompression()
+    raise ValueError(f"compression must be 'gzip', 'zstd' or 'none', not {compression!r}")
+
+
+class _NoCompression:
+    ''' stands in for a compressor when the archive is not compressed '''
+
+    def compress(self, data:bytes):
+        return data
+
+    def flush(self):
+        return b''
+
+
+class _VolumeWriter:
+    '''
+    write a byte stream to numbered volume files of at most `volume_size`
+    bytes (no limit if volume_size is 0), like the unix `split` command.
+    '''
+
+    def __init__(self, base_path:str, volume_size:int=0):
+        self.base_path = base_path
+        self.volume_size = volume_size
+        self.volumes = []
+        self.offset = 0
+        self._file = None
+        self._room = 0
+
+    def _next_volume(self):
+        if self._file is not None:
+            self._file.close()
+        path = f'{self.base_path}.{len(self.volumes):03d}' if self.volume_size else self.base_path
+        self.volumes.append(path)
+        # never truncate a volume that is already there
+        self._file = open(path, 'xb')
+        self._room = self.volume_size
+
+    def write(self, data:bytes):
+        view = memoryview(data)
+        while view:
+            if self._file is None or (self.volume_size and self._room == 0):
+                self._next_volume()
+            n = min(len(view), self._room) if self.volume_size else len(view)
+            self._file.write(view[:n])
+            self._room -= n
+            self.offset += n
+            view = view[n:]
+
+    def close(self):
+        if self._file is None:
+            self._next_volume()
+        self._file.close()
+
+
+class _QueueWriter:
+    '''
+    file-like object that tarfile writes to. the uncompressed bytes are
+    gathered into chunks and put on a bounded queue for the compression
+    thread, so reading files and compressing run in parallel.
+    '''
+
+    def __init__(self, chunks, chunk_size:int=1 << 20):
+        self.chunks = chunks
+        self.chunk_size = chunk_size
+        self.offset = 0
+        self._buffer = bytearray()
+
+    def tell(self):
+        return self.offset
+
+    def write(self, data:bytes):
+        self._buffer += data
+        self.offset += len(data)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self.chunks.put(bytes(self._buffer))
+            self._buffer = bytearray()
+
+    def new_frame(self):
+        ''' the next bytes start a new compressed frame '''
+        self.flush()
+        self.chunks.put(_NEW_FRAME)
+
+
+def _compress_stream(chunks, volumes:_VolumeWriter, compression:str, frames:list, errors:list):
+    '''
+    compression stage of the archive pipeline, this runs on its own thread.
+
+    takes chunks off the queue until it gets None, and appends the
+    (uncompressed offset, compressed offset) where each frame starts to
+    `frames`.
+    '''
+    try:
+        compressor = _compressor(compression)
+        uncompressed = 0
+        frames.append((0, 0))
+        while (chunk := chunks.get()) is not None:
+            if chunk is _NEW_FRAME:
+                volumes.write(compressor.flush())
+                compressor = _compressor(compression)
+                frames.append((uncompressed, volumes.offset))
+                continue
+            volumes.write(compressor.compress(chunk))
+            uncompressed += len(chunk)
+        volumes.write(compressor.flush())
+        volumes.close()
+    except BaseException as e:
+        errors.append(e)
+        # keep draining so the reading side never blocks on a full queue
+        while chunks.get() is not None:
+            pass
+
+
+def _reserve_archive_name(destination:str, extension:str)->str:
+    '''
+    pick the path of a new archive, `backup-<date>-<time>`, with a counter
+    added when an archive of the same second is already there. the name
+    is reserved by creating its index file, so an archive is never
+    overwritten, even by a run started at the same time.
+
+    return:
+        the path of the archive (of its first volume without a volume size)
+    '''
+    name = 'backup-' + datetime.now().strftime('%Y%m%d-%H%M%S')
+    counter = 0
+    while True:
+        base_path = os.path.join(destination, (f'{name}-{counter}' if counter else name) + extension)
+        try:
+            open(base_path + ARCHIVE_INDEX_SUFFIX, 'x').close()
+        except FileExistsError:
+            counter += 1
+            continue
+        if not any(os.path.exists(path) for path in (base_path, base_path + '.000')):
+            return base_path
+        # volumes without an index, from a run that failed: leave them alone
+        os.remove(base_path + ARCHIVE_INDEX_SUFFIX)
+        counter += 1
+
+
+def archive_backup(source:str, destination:str, plan:BackupPlan, compression:str='gzip',
+                   volume_size:int=0, frame_size:int=16 << 20, report:dict=None,
+                   manifest:Manifest=None, progress=None):
+    '''
+    back up the planned files into a single tar archive instead of a tree.
+
+    the files are read and written into the tar stream on this thread
+    while a second thread compresses the stream and writes it out, so
+    many small files cost one sequential write. the compressed stream
+    is made of independent frames of about `frame_size` uncompressed
+    bytes, and an index of where each member starts is kept, so one file
+    can be restored without decompressing the whole archive (see
+    `restore_from_archive`).
+
+    args:
+        source (str): path of the source folder
+        destination (str): folder the archive is written to
+        plan (BackupPlan): the files to archive
+        compression (str): 'gzip', 'zstd' or 'none'
+        volume_size (int): split the archive into volumes of this many bytes (0: one file)
+        frame_size (int): uncompressed bytes per independently compressed frame
+        report (dict): filled with the archive details and member index (optional)
+        manifest (Manifest): record of the files backed up (optional)
+        progress: function called with (files done, bytes done) (optional)
+
+    return:
+        number of files archived
+    '''
+    import queue
+    import tarfile
+    from bisect import bisect_right
+
+    extension = {'gzip': '.tar.gz', 'zstd': '.tar.zst', 'none': '.tar'}.get(compression, '.tar')
+    # check the compression before any thread starts
+    _compressor(compression)
+    os.makedirs(destination, exist_ok=True)
+    base_path = _reserve_archive_name(destination, extension)
+
+    chunks = queue.Queue(maxsize=8)
+    volumes = _VolumeWriter(base_path, volume_size)
+    frames = []
+    errors = []
+    stage = threading.Thread(target=_compress_stream, name='archive-compress',
+                             args=(chunks, volumes, compression, frames, errors))
+    stage.start()
+
+    stream = _QueueWriter(chunks)
+    # member name, size and uncompressed offset of its tar header
+    members = []
+    num_bytes = 0
+    start = time.perf_counter()
+    try:
+        with tarfile.open(fileobj=stream, mode='w', format=tarfile.PAX_FORMAT) as tar:
+            tar.copybufsize = 1 << 20
+            frame_start = 0
+            for entry in plan:
+                if errors:
+                    break
+                if stream.offset - frame_start >= frame_size:
+                    stream.new_frame()
+                    frame_start = stream.offset
+                src_path = os.path.join(source, entry.rel_path)
+                arcname = entry.rel_path.replace(os.sep, '/')
+                member_offset = tar.offset
+                with open(src_path, 'rb') as f:
+                    # from the open file, so links are followed like in the copy
+                    info = tar.gettarinfo(arcname=arcname, fileobj=f)
+                    tar.addfile(info, f)
+                # the archive must not keep every member in memory
+                tar.members.clear()
+                tar.inodes.clear()
+                members.append((arcname, info.size, member_offset))
+                num_bytes += info.size
+                if manifest is not None:
+                    manifest.update(entry.rel_path, entry.size, entry.mtime_ns)
+                if progress is not None and len(members) % 64 == 0:
+                    progress(len(members), num_bytes)
+        stream.flush()
+    finally:
+        chunks.put(None)
+        stage.join()
+    if errors:
+        raise errors[0]
+    seconds = time.perf_counter() - start
+    if progress is not None:
+        progress(len(members), num_bytes)
+
+    # point each member at the frame it starts in
+    frame_starts = [frame[0] for frame in frames]
+    index = {
+        'compression': compression,
+        'volume size': volume_size,
+        'volumes': [os.path.basename(path) for path in volumes.volumes],
+        # per frame: [uncompressed offset, compressed offset]
+        'frames': [list(frame) for frame in frames],
+        # per member: [name, size, frame number, offset of the header in the frame]
+        'members': [],
+    }
+    for arcname, size, offset in members:
+        frame = bisect_right(frame_starts, offset) - 1
+        index['members'].append([arcname, size, frame, offset - frame_starts[frame]])
+    # the index file was created empty to reserve the name
+    with open(base_path + ARCHIVE_INDEX_SUFFIX, 'w') as f:
+        json.dump(index, f)
+
+    if manifest is not None:
+        manifest.save()
+
+    if report is not None:
+        report['archive'] = {
+            'path': base_path,
+            'compression': compression,
+            'volumes': index['volumes'],
+            'bytes in': num_bytes,
+            'bytes out': volumes.offset,
+            'seconds': round(seconds, 3),
+            'MB per second': round(num_bytes / 1e6 / seconds, 3) if seconds else None,
+        }
+        report['archive index'] = index
+
+    return len(members)
+
+
+class _VolumeReader:
+    ''' read the volumes of an archive as one stream, starting at `offset` '''
+
+    def __init__(self, folder:str, index:dict, offset:int):
+        self.paths = [os.path.join(folder, volume) for volume in index['volumes']]
+        volume_size = index['volume size']
+        self.volume = offset // volume_size if volume_size else 0
+        self._file = open(self.paths[self.volume], 'rb')
+        self._file.seek(offset - self.volume * volume_size)
+
+    def read(self, n:int=-1):
+        data = self._file.read(n)
+        while not data and self.volume + 1 < len(self.paths):
+            self._file.close()
+            self.volume += 1
+            self._file = open(self.paths[self.volume], 'rb')
+            data = self._file.read(n)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class _FrameReader:
+    ''' decompress an archive stream from the start of a frame, across frames '''
+
+    def __init__(self, raw:_VolumeReader, compression:str):
+        self.raw = raw
+        self.compression = compression
+        self._buffer = b''
+        self._eof = False
+        if compression == 'gzip':
+            import zlib
+            self._zlib = zlib
+            self._decompressor = zlib.decompressobj(31)
+        elif compression == 'zstd':
+            import zstandard
+            self._zstd = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+
+    def _fill(self, n:int):
+        while len(self._buffer) < n and not self._eof:
+            if self.compression == 'gzip':
+                compressed = b''
+                if self._decompressor.eof:
+                    # the next frame is a new gzip member
+                    compressed = self._decompressor.unused_data
+                    self._decompressor = self._zlib.decompressobj(31)
+                compressed = compressed or self.raw.read(1 << 20)
+                if not compressed:
+                    self._eof = True
+                    break
+                self._buffer += self._decompressor.decompress(compressed)
+                continue
+            if self.compression == 'zstd':
+                data = self._zstd.read(1 << 20)
+            else:
+                data = self.raw.read(1 << 20)
+            if not data:
+                self._eof = True
+            self._buffer += data
+
+    def read(self, n:int=-1):
+        if n < 0:
+            self._fill(float('inf'))
+            n = len(self._buffer)
+        self._fill(n)
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+
+def restore_from_archive(archive_path:str, member_name:str, target_folder:str):
+    '''
+    restore a single file from an archive made by `archive_backup`.
+
+    the member index (saved next to the archive) gives the frame the file
+    starts in, so only that part of the archive is read and decompressed.
+
+    args:
+        archive_path (str): path of the archive, as in `results.json`
+        member_name (str): name of the file in the archive (relative path)
+        target_folder (str): folder the file is restored into
+
+    return:
+        path of the restored file
+    '''
+    import tarfile
+
+    with open(archive_path + ARCHIVE_INDEX_SUFFIX) as f:
+        index = json.load(f)
+    member_name = member_name.replace(os.sep, '/')
+    for name, size, frame, offset in index['members']:
+        if name == member_name:
+            break
+    else:
+        raise KeyError(f'{member_name} is not in {archive_path}')
+
+    raw = _VolumeReader(os.path.dirname(archive_path), index, index['frames'][frame][1])
+    try:
+        stream = _FrameReader(raw, index['compression'])
+        # skip to the header of the member inside the frame
+        while offset:
+            skipped = len(stream.read(min(offset, 1 << 20)))
+            if not skipped:
+                raise ValueError(f'{archive_path} is truncated')
+            offset -= skipped
+        # the 'data' filter refuses absolute paths and links out of the folder
+        extract_args = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            info = tar.next()
+            tar.extract(info, target_folder, **extract_args)
+    finally:
+        raw.close()
+    return os.path.join(target_folder, *member_name.split('/'))
+
+
+# %%
+
+# inotify event flags (see `man 7 inotify`)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+
+class _Inotify:
+    ''' minimal inotify wrapper (linux only), made with ctypes '''
+
+    _event = struct.Struct('iIII')
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._ctypes = ctypes
+
+    def add_watch(self, path:str, mask:int=_WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = self._ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read(self, timeout:float):
+        '''
+        wait up to `timeout` seconds for events.
+
+        return:
+            list of (watch descriptor, mask, name)
+        '''
+        import select
+
+        events = []
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return events
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self._event.unpack_from(data, offset)
+            offset += self._event.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    '''
+    keep the destination up to date as files change in the source folder,
+    without walking the whole tree again.
+
+    on linux, inotify reports the changed files directly. elsewhere (or if
+    inotify cannot be used) the modification time of each folder is polled
+    and only the folders that changed are listed again. polling notices
+    files that are created, renamed or replaced, but not a file edited in
+    place in a folder that did not change.
+
+    changed files are copied in small batches once they have not changed
+    for `debounce` seconds, and the time from the first event to the copy
+    (latency) is recorded.
+
+    args:
+        source (str): path of the source folder
+        destination (str): path of the destination folder
+        cutoff_date (float): cut off date in seconds since the epoch
+        manifest (Manifest): record of the files backed up, unchanged files are not copied
+        debounce (float): seconds without changes before a file is copied
+        interval (float): seconds between polls of the folders
+        batch_size (int): maximum number of files copied at a time
+        use_inotify (bool): use inotify when available
+        options (CopyOptions): settings of the copy
+    '''
+
+    def __init__(self, source:str, destination:str, cutoff_date:float, manifest:Manifest,
+                 debounce:float=0.5, interval:float=1.0, batch_size:int=64,
+                 use_inotify:bool=True, options:CopyOptions=CopyOptions()):
+        self.source = source
+        self.destination = destination
+        self.cutoff_date = cutoff_date
+        self.manifest = manifest
+        self.debounce = debounce
+        self.interval = interval
+        self.batch_size = batch_size
+        self.options = options
+        # relative path -> [time of the first event, time of the last event]
+        self.pending = {}
+        # relative folder -> modification time (poll mode)
+        self.directories = {}
+        # watch descriptor -> relative folder (inotify mode)
+        self._watches = {}
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = _Inotify()
+            except OSError:
+                self._inotify = None
+        # 'inotify' or 'poll'
+        self.method = 'inotify' if self._inotify is not None else 'poll'
+        # destination folders known to exist
+        self._created = set()
+        self.files_copied = 0
+        self.latencies = []
+        self._last_save = time.monotonic()
+        # when the folders are polled next (poll mode)
+        self._next_poll = time.monotonic() + interval
+
+    def start(self):
+        ''' take the snapshot of the folders (and add the inotify watches) '''
+        if self.options.dedup:
+            make_directories(os.path.join(self.destination, STORE_FOLDER), (f'{i:02x}' for i in range(256)))
+        self._add_tree('', scan_files=False)
+
+    def _add_tree(self, rel_dir:str, scan_files:bool=True):
+        '''
+        add a folder and the folders below it to the snapshot. with
+        scan_files, the files found are checked for changes too (used for
+        folders that appear while watching).
+        '''
+        now = time.monotonic()
+        stack = [rel_dir]
+        while stack:
+            rel_dir = stack.pop()
+            folder = os.path.join(self.source, rel_dir)
+            try:
+                if self._inotify is not None:
+                    try:
+                        self._watches[self._inotify.add_watch(folder)] = rel_dir
+                    except OSError:
+                        # out of watches: carry on by polling
+                        self._inotify.close()
+                        self._inotify = None
+                        self._watches = {}
+                        self.method = 'poll'
+                        self._add_tree('', scan_files=False)
+                        return
+                mtime_ns = os.stat(folder).st_mtime_ns
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            self.directories[rel_dir] = mtime_ns
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(rel_path)
+                elif scan_files:
+                    self._file_event(rel_path, now)
+
+    def _file_event(self, rel_path:str, now:float):
+        ''' a file may have changed '''
+        if rel_path in self.pending:
+            self.pending[rel_path][1] = now
+        else:
+            self.pending[rel_path] = [now, now]
+
+    def _poll(self):
+        ''' look for folders whose modification time changed '''
+        now = time.monotonic()
+        for rel_dir, mtime_ns in list(self.directories.items()):
+            folder = os.path.join(self.source, rel_dir)
+            try:
+                new_mtime_ns = os.stat(folder).st_mtime_ns
+                if new_mtime_ns == mtime_ns:
+                    continue
+                entries = list(os.scandir(folder))
+            except OSError:
+                # the folder was removed
+                del self.directories[rel_dir]
+                continue
+            self.directories[rel_dir] = new_mtime_ns
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if rel_path not in self.directories:
+                        self._add_tree(rel_path)
+                else:
+                    self._file_event(rel_path, now)
+
+    def _read_events(self, timeout:float):
+        ''' take the events reported by inotify '''
+        events = self._inotify.read(timeout)
+        now = time.monotonic()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, check every folder again
+                self._add_tree('')
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            rel_dir = self._watches.get(wd)
+            if rel_dir is None or not name:
+                continue
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(rel_path)
+            else:
+                self._file_event(rel_path, now)
+
+    def step(self, timeout:float=None):
+        '''
+        wait for changes (at most `timeout` seconds) and copy the files
+        that are ready.
+
+        return:
+            number of files copied
+        '''
+        if self._inotify is not None:
+            self._read_events(self.debounce if timeout is None else timeout)
+            return self.flush()
+
+        # poll every `interval` seconds, but wake up in between when a
+        # pending file has been quiet for `debounce` seconds
+        now = time.monotonic()
+        wake = self._next_poll
+        if self.pending:
+            wake = min(wake, min(last for first, last in self.pending.values()) + self.debounce)
+        if timeout is not None:
+            wake = min(wake, now + timeout)
+        time.sleep(max(0.0, wake - now))
+        if time.monotonic() >= self._next_poll:
+            self._poll()
+            self._next_poll = time.monotonic() + self.interval
+        return self.flush()
+
+    def flush(self, force:bool=False):
+        '''
+        copy the pending files that have been quiet for `debounce` seconds
+        (or all of them with force).
+
+        return:
+            number of files copied
+        '''
+        now = time.monotonic()
+        ready = [rel_path for rel_path, (first, last) in self.pending.items()
+                 if force or now - last >= self.debounce]
+        copied = 0
+        for i in range(0, len(ready), self.batch_size):
+            copied += self._copy(ready[i:i + self.batch_size])
+        if copied and time.monotonic() - self._last_save > 60:
+            self.manifest.save()
+            self._last_save = time.monotonic()
+        return copied
+
+    def _copy(self, rel_paths:list):
+        ''' copy a batch of files and record the latency '''
+        entries = []
+        first_events = []
+        for rel_path in rel_paths:
+            first, last = self.pending.pop(rel_path)
+            try:
+                st = os.stat(os.path.join(self.source, rel_path))
+            except OSError:
+                # removed since the event
+                continue
+            if st.st_mtime <= self.cutoff_date:
+                continue
+            if self.manifest.unchanged(rel_path, st.st_size, st.st_mtime_ns):
+                continue
+            entries.append(PlanEntry(rel_path, st.st_size, st.st_mtime_ns))
+            first_events.append(first)
+        if not entries:
+            return 0
+
+        new_dirs = {os.path.dirname(entry.rel_path) for entry in entries} - self._created
+        make_directories(self.destination, new_dirs)
+        self._created |= new_dirs
+        stats = _copy_batch(self.source, self.destination, entries, self.options)
+        done = time.monotonic()
+        for entry, digest in stats['copied']:
+            self.manifest.update(entry.rel_path, entry.size, entry.mtime_ns, digest)
+        self.latencies.extend(done - first for first in first_events)
+        # only the recent latencies are kept
+        del self.latencies[:-10000]
+        self.files_copied += stats['files']
+        return stats['files']
+
+    def latency_report(self)->dict:
+        ''' summary of the event to copy latency of the recent copies '''
+        if not self.latencies:
+            return {'files copied': self.files_copied}
+        latencies = sorted(self.latencies)
+        return {
+            'files copied': self.files_copied,
+            'latency mean seconds': round(sum(latencies) / len(latencies), 4),
+            'latency median seconds': round(latencies[len(latencies) // 2], 4),
+            'latency max seconds': round(latencies[-1], 4),
+        }
+
+    def run(self, stop:threading.Event=None, progress=None):
+        '''
+        watch until `stop` is set (or until interrupted with ctrl-c).
+
+        args:
+            stop (threading.Event): set it to stop watching (optional)
+            progress: function called with a dict after each copy (optional)
+        '''
+        if stop is None:
+            stop = threading.Event()
+        self.start()
+        try:
+            while not stop.is_set():
+                if self.step() and progress is not None:
+                    progress(dict(event='watch', method=self.method, **self.latency_report()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.flush(force=True)
+            self.manifest.save()
+            self.close()
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+def watch_backup(config:dict, stop:threading.Event=None, progress=None)->dict:
+    '''
+    run a backup (see `run_backup`) and then keep watching the source
+    folder, copying files as they change.
+
+    args:
+        config (dict): settings, with the same keys as `inputs.json`
+        stop (threading.Event): set it to stop watching (optional)
+        progress: function called with a dict for each progress event (optional)
+
+    return:
+        the latency report of the watch
+    '''
+    config = dict(config, mode='mirror')
+    run_backup(config, progress=progress)
+
+    cutoff_date = time.mktime(time.strptime(config['cut off date'], "%Y-%m-%d"))
+    options = CopyOptions(hash_files=config.get('hash files', False),
+                          dedup=config.get('dedup', False),
+                          zero_copy_threshold=int(config.get('zero copy threshold MB', 1) * 2**20))
+    watcher = Watcher(config['source folder'], config['destination folder'], cutoff_date,
+                      Manifest(config['destination folder']),
+                      debounce=config.get('watch debounce seconds', 0.5),
+                      interval=config.get('watch poll seconds', 1.0),
+                      options=options)
+    watcher.run(stop, progress)
+    return watcher.latency_report()
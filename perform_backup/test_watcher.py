@@ -0,0 +1,72 @@
+''' tests of the Watcher in main_backup.py, with inotify and with polling: python -m pytest perform_backup '''
+
+import time
+
+import pytest
+
+from perform_backup.main_backup import Manifest, Watcher
+
+
+def step_until_copied(watcher, n_files:int, seconds:float=10)->int:
+    ''' step the watcher until n_files are copied (or `seconds` have passed) '''
+    deadline = time.monotonic() + seconds
+    copied = 0
+    while copied < n_files and time.monotonic() < deadline:
+        copied += watcher.step(timeout=0.1)
+    return copied
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_watcher_copies_new_files(tmp_path, use_inotify):
+    source = tmp_path / 'source'
+    destination = tmp_path / 'destination'
+    (source / 'old').mkdir(parents=True)
+    (source / 'old' / 'a.txt').write_text('a')
+    destination.mkdir()
+
+    watcher = Watcher(str(source), str(destination), 0, Manifest(str(destination)),
+                      debounce=0.2, interval=0.3, use_inotify=use_inotify)
+    if use_inotify and watcher.method != 'inotify':
+        pytest.skip('inotify is not available here')
+    assert watcher.method == ('inotify' if use_inotify else 'poll')
+    watcher.start()
+    try:
+        (source / 'b.txt').write_text('b')
+        (source / 'new').mkdir()
+        (source / 'new' / 'c.txt').write_text('c')
+        assert step_until_copied(watcher, 2) == 2
+        # nothing else changed
+        assert watcher.step(timeout=0.5) == 0
+    finally:
+        watcher.close()
+
+    assert (destination / 'b.txt').read_text() == 'b'
+    assert (destination / 'new' / 'c.txt').read_text() == 'c'
+    # files that were there before the watch started are left to run_backup
+    assert not (destination / 'old').exists()
+
+    report = watcher.latency_report()
+    assert report['files copied'] == 2
+    # a file is copied once it has been quiet for `debounce` seconds
+    assert 0.2 <= report['latency median seconds'] <= report['latency max seconds'] < 5
+
+
+def test_watcher_polls_at_the_interval(tmp_path):
+    source = tmp_path / 'source'
+    destination = tmp_path / 'destination'
+    source.mkdir()
+    destination.mkdir()
+
+    watcher = Watcher(str(source), str(destination), 0, Manifest(str(destination)),
+                      debounce=0.1, interval=0.5, use_inotify=False)
+    polls = []
+    poll = watcher._poll
+    watcher._poll = lambda: (polls.append(time.monotonic()), poll())
+    watcher.start()
+    start = time.monotonic()
+    while time.monotonic() - start < 1.6:
+        watcher.step()
+    # not every `debounce` seconds
+    assert 3 <= len(polls) <= 4
+    assert polls[0] - start >= 0.45
+    assert all(0.45 <= later - earlier < 0.75 for earlier, later in zip(polls, polls[1:]))